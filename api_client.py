@@ -5,6 +5,7 @@ import asyncio
 import backoff
 import inspect
 import logging
+import time
 from dataclasses import dataclass
 from datetime import datetime, timezone
 from enum import Enum
@@ -13,6 +14,7 @@ from urllib.parse import urljoin
 from pydantic import BaseModel, ValidationError, field_validator, model_validator
 
 import config
+import metrics
 from models.constants import UtcDatetime
 from models.event import MlsEvent, MatchEventResponse
 from models.match import ComprehensiveMatchData, Match_Base, Match_Sport
@@ -215,12 +217,15 @@ class MLSApiClient:
                 last_requests.pop(0)
             last_requests.append(now)
             
+            status = 'error'
+            start = time.perf_counter()
             try:
                 async with session.get(
                     url,
                     params=params,
                     timeout=self.config.timeout
                 ) as response:
+                    status = str(response.status)
                     if response.status == 204:  # No content
                         return {}
                     if response.status == 404 and allow_404:
@@ -261,9 +266,15 @@ class MLSApiClient:
                     return response_data
                     
             except asyncio.TimeoutError as e:
+                status = 'timeout'
                 raise MLSApiTimeoutError(f"Request to {url} timed out") from e
             except aiohttp.ClientError as e:
                 raise MLSApiError(f"Request to {url} failed: {str(e)}") from e
+            finally:
+                metrics.API_REQUEST_SECONDS.observe(
+                    time.perf_counter() - start, endpoint=endpoint.value, route=metrics.route(path)
+                )
+                metrics.API_RESPONSES.inc(endpoint=endpoint.value, status=status)
 
     # Stats API endpoints
     async def get_match_stats_deprecated(self, match_id: int) -> List[Dict[str, Any]]:
@@ -443,7 +454,7 @@ class MLSApiClient:
 
     async def get_standings(
         self,
-        season_id: int,
+        season_id: str,
         competition: Competition = Competition.MLS,
         is_live: bool = True
     ) -> Dict[str, Any]:
@@ -506,9 +517,11 @@ class MLSApiClient:
     async def get_schedule(self, season: str, **kwargs) -> List[MatchSchedule]:
         """Get schedule"""
         params = {
-            "per_page": 100,
+            "per_page": kwargs.get("per_page", 100),
             "sort": "planned_kickoff_time:asc,home_team_name:asc"
         }
+        if kwargs.get("page"):
+            params["page"] = kwargs["page"]
         if kwargs.get("match_date_gte"):
             params["match_date[gte]"] = kwargs["match_date_gte"]
         if kwargs.get("match_date_lte"):
@@ -533,6 +546,55 @@ class MLSApiClient:
                     logger.error(error['loc'][0])
             raise
     
+    async def get_full_schedule(
+        self,
+        season: str,
+        pages_per_batch: int = 4,
+        max_pages: int = 20,
+        **kwargs
+    ) -> List[MatchSchedule]:
+        """Get every page of a schedule query, fetching pages concurrently
+
+        Page 1 is fetched alone; further pages are requested in batches of
+        ``pages_per_batch`` until one comes back short, a batch adds no new
+        matches (the API ignoring ``page``), or ``max_pages`` is reached. If
+        page 1 is shorter than ``per_page`` the server may be capping the
+        page size, so page 2 is checked before giving up. Accepts the same
+        filters as ``get_schedule``.
+        """
+        per_page = kwargs.pop("per_page", 100)
+        kwargs.pop("page", None)
+        matches: Dict[str, MatchSchedule] = {}
+        first = await self.get_schedule(season, page=1, per_page=per_page, **kwargs)
+        for match in first:
+            matches[match.match_id] = match
+        # the server's page size, in case it caps per_page
+        page_size = len(first)
+        page = 2
+        batch_size = pages_per_batch if page_size >= per_page else 1
+        while page_size and page <= max_pages:
+            pages = range(page, min(page + batch_size, max_pages + 1))
+            batch = await asyncio.gather(*(
+                self.get_schedule(season, page=p, per_page=per_page, **kwargs) for p in pages
+            ))
+            added = 0
+            for result in batch:
+                for match in result:
+                    if match.match_id not in matches:
+                        added += 1
+                    matches[match.match_id] = match
+            if not added or any(len(result) < page_size for result in batch):
+                break
+            page += len(pages)
+            batch_size = pages_per_batch
+        else:
+            if page_size and page > max_pages:
+                logger.warning(f'Schedule query for {season} stopped at {max_pages} pages')
+        return sorted(
+            matches.values(),
+            key=lambda m: (m.planned_kickoff_time is None, m.planned_kickoff_time or datetime.min.replace(tzinfo=timezone.utc))
+        )
+
     async def get_match_schedule(self, match_id: str, **kwargs) -> MatchSchedule:
         """Get schedule object for a single match"""
         data = await self._make_request(
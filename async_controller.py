@@ -2,26 +2,37 @@ import argparse
 import asyncio
 import logging, logging.handlers
 import time
-import traceback
 
-from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, JobEvent
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED, EVENT_JOB_MISSED, JobEvent
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.jobstores.sqlalchemy import SQLAlchemyJobStore
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.job import Job
-from datetime import datetime, date, timedelta
+from datetime import date, datetime, timedelta
 
 from api_client import MLSApiClient, MLSApiClientError
-import discipline
+import datasets
 import discord as msg
-import injuries
-import match_thread as thread
-import mls_schedule
-import mls_playwright
+import jobs
+from loop_monitor import LoopMonitor
+import metrics
+from planner import SeasonPlanner
+import reddit_client
+import schedule_index
 from models.constants import get_current_season
 from thread_manager import ThreadManager
 import widgets
+from workers import WorkerPool
 from config import FEATURE_FLAGS, SUB, TEAMS, THREADS_JSON
-from util import names
+
+# days ahead fetched by the periodic schedule check
+REFRESH_WINDOW_DAYS = 7
+# thread jobs survive restarts here; recurring jobs are re-added at startup
+JOBS_DB = 'sqlite:///data/jobs.sqlite'
+# address-space limit for scraper and widget worker processes
+WORKER_MEMORY_MB = 1024
 
 # Configure logging
 fh = logging.handlers.RotatingFileHandler('log/debug.log', maxBytes=1000000, backupCount=10)
@@ -52,14 +63,35 @@ class AsyncController:
     
     def __init__(self, subreddit: str):
         self.subreddit = subreddit
-        self.scheduler = AsyncIOScheduler()
+        self.scheduler = AsyncIOScheduler(
+            jobstores={
+                'default': MemoryJobStore(),
+                'threads': SQLAlchemyJobStore(url=JOBS_DB)
+            },
+            job_defaults={
+                # run a missed recurring job once, if it is less than an hour late
+                'coalesce': True,
+                'max_instances': 1,
+                'misfire_grace_time': 3600
+            }
+        )
+        self.workers = WorkerPool(max_workers=2)
+        self.planner = SeasonPlanner(
+            self.scheduler, schedule_index.get_index(), subreddit, TEAMS, jobstore='threads'
+        )
+        
+        self.widget_source = FEATURE_FLAGS.get('widget_source', 'playwright')
+        if FEATURE_FLAGS['enable_widgets'] and self.widget_source == 'renderer':
+            jobs.after_match.append(self.refresh_widgets)
         
         # Add job listeners for logging
         self.scheduler.add_listener(self._job_executed, EVENT_JOB_EXECUTED)
         self.scheduler.add_listener(self._job_error, EVENT_JOB_ERROR)
+        self.scheduler.add_listener(self._job_missed, EVENT_JOB_MISSED)
     
     def _job_executed(self, event: JobEvent):
         """Log successful job execution"""
+        metrics.SCHEDULER_JOBS.inc(job=metrics.route(event.job_id), outcome='executed')
         job: Job = self.scheduler.get_job(event.job_id)
         if job:
             message = f'Job {job.name} executed successfully'
@@ -68,166 +100,129 @@ class AsyncController:
     
     def _job_error(self, event: JobEvent):
         """Log job execution errors"""
+        metrics.SCHEDULER_JOBS.inc(job=metrics.route(event.job_id), outcome='error')
         job: Job = self.scheduler.get_job(event.job_id)
-        message = f'Error in job {job.name}: {str(event.exception)}'
+        # one-off jobs are already gone from the job store
+        message = f'Error in job {job.name if job else event.job_id}: {str(event.exception)}'
         root.error(message)
         msg.send(message, tag=True)
+
+    def _job_missed(self, event: JobEvent):
+        """Log jobs skipped because they were past their misfire grace time"""
+        metrics.SCHEDULER_JOBS.inc(job=metrics.route(event.job_id), outcome='missed')
+        root.warning(f'Job {event.job_id} missed its run time {event.scheduled_run_time}')
         
-    async def create_match_thread(self, sportec_id: str, post: bool = True):
-        """Create a match thread in an async context"""
-        message = f'Posting match thread for {sportec_id} on subreddit {self.subreddit}'
-        root.info(message)
-        await msg.async_send(message, tag=True)
+    async def refresh_schedule(self, full: bool = True) -> str:
+        """Refresh the schedule index and reconcile the planned thread jobs
+
+        A full refresh pulls the whole season; otherwise only the upcoming
+        week is fetched, which is enough to catch kickoff changes.
+        """
+        index = schedule_index.get_index()
+        kwargs = {}
+        if not full:
+            today = date.today()
+            kwargs = {
+                'match_date_gte': today.isoformat(),
+                'match_date_lte': (today + timedelta(days=REFRESH_WINDOW_DAYS)).isoformat()
+            }
+        async with MLSApiClient() as client:
+            changed = await index.refresh(client, get_current_season(), **kwargs)
+        changes = self.planner.reconcile()
+        return f'Schedule index refreshed: {len(changed)} of {len(index)} matches changed. Jobs: {changes}.'
+
+    async def refresh_widgets(self, match_id: str) -> None:
+        """Redraw the standings and schedule widgets once a match is over"""
+        root.info(f'Refreshing widgets after match {match_id}')
+        await self.workers.run('widget_renderer:render', timeout=300, memory_mb=WORKER_MEMORY_MB)
+        await widgets.update_image_widgets(widgets.IMAGE_WIDGETS, self.subreddit)
 
-        try:
-            await thread.match_thread(sportec_id, self.subreddit, post=post)
-        except Exception as e:
-            root.error(f"Error creating match thread: {str(e)}")
-            await msg.async_send(f"Error creating match thread for {sportec_id}: {str(e)}")
-    
     async def daily_setup(self):
-        """Check for upcoming matches and schedule threads"""
+        """Refresh the season schedule and plan threads for the rest of the season"""
         message = "Running daily setup..."
         root.info(message)
         await msg.async_send(message)
 
-        for team in TEAMS:
+        try:
+            summary = [await self.refresh_schedule()]
+        except Exception as e:
+            root.exception(f"Error fetching schedule: {str(e)}")
+            # API errors are expected now and then; anything else needs a look
+            await msg.async_send(f"Error fetching schedule: {str(e)}", not isinstance(e, MLSApiClientError))
+            # still plan from the last known schedule
             try:
-                async with MLSApiClient() as client:
-                    # Get schedule data
-                    await msg.async_send(f"Checking schedule for team {team}")
-                    from_date = date.today() - timedelta(days=5)
-                    to_date = date.today() + timedelta(days=5)
-
-                    data = await client.get_schedule(
-                        season=get_current_season(),
-                        match_date_gte=from_date.isoformat(),
-                        match_date_lte=to_date.isoformat(),
-                        team_id=names[team].sportec_id
-                    )
-
-                # Check for upcoming matches
-                # use a starting time of 3 hours ago to check for ongoing matches as well
-                match_id, match_time = mls_schedule.check_pre_match_sched(data, date_from=int(time.time()) - 10800)
-                
-                if match_id is not None:
-                    local_time = match_time.astimezone()
-                    await msg.async_send(f'Match coming up: {match_id}, {local_time}')
-
-                    # Check if match is within next 24 hours
-                    now = time.time()
-                    today = time.time() + 86400
-                    if match_time.timestamp() < today and datetime.now().date() == local_time.date():
-                        root.info("checking and/or shceduling thread")
-                        # Schedule match thread for 30 mins before game
-                        thread_time = datetime.fromtimestamp(match_time.timestamp() - 1800)
-
-                        if thread_time.timestamp() < now:
-                            root.info('whoops. creating thread')
-                            await self.create_match_thread(match_id, team != 19202)
-                        else:
-                            root.info('scheduling thread')
-                            self.scheduler.add_job(
-                                self.create_match_thread,
-                                'date',
-                                run_date=thread_time,
-                                args=[match_id, team != 19202],  # post-match thread only if not CITY2
-                                name=f'match_thread_{match_id}',
-                                replace_existing=True
-                            )
-                            
-                            message = f'Scheduled match thread for {thread_time.strftime("%H:%M")}. Team {team}, Opta ID {match_id}'
-                            root.info(message)
-                            await msg.async_send(message)
-                        
-                        current_hour = datetime.now().hour
-                        # Schedule pre-match thread if not CITY2
-                        if current_hour < 4 and team != 19202:
-                            pre_match_time = datetime.now().replace(hour=4, minute=0)
-                            
-                            self.scheduler.add_job(
-                                thread.pre_match_thread,
-                                'date',
-                                run_date=pre_match_time,
-                                args=[match_id, self.subreddit],
-                                name=f'pre_match_thread_{match_id}',
-                                replace_existing=True
-                            )
-                            
-                            message = f'Scheduled pre-match thread for {pre_match_time.strftime("%H:%M")}. Team {team}, Opta ID {match_id}'
-                            root.info(message)
-                            await msg.async_send(message)
-
-                        # catch up if no pre-match thread posted yet
-                        if current_hour >= 4 and current_hour < 9 and team != 19202:
-                            threads = file_manager.get_threads(str(match_id))
-                            if threads is None or not threads.pre:
-                                # immediately create match_thread
-                                message = f"No pre-match found, creating catch-up thread for {match_id}"
-                                root.info(message)
-                                await msg.async_send(message, True)
-                                try:
-                                    await thread.pre_match_thread(match_id, self.subreddit)
-                                except Exception as e:
-                                    error_msg = f"Error creating pre-match thread: {str(e)}"
-                                    root.error(error_msg)
-                                    root.error(traceback.format_exc())
-                                    await msg.async_send(error_msg, tag=True)
-                    
-                    # If match has started but not likely finished (within last 3 hours)
-                    elif match_time.timestamp() < now and now - match_time.timestamp() < 10800:
-                        threads = file_manager.get_threads(str(match_id))
-                        if threads and threads.match and not threads.post:
-                            # Resume match thread updates
-                            try:
-                                await thread.match_thread(match_id, self.subreddit)
-                            except Exception as e:
-                                error_msg = f"Error catching up on match thread: {str(e)}"
-                                root.error(error_msg)
-                                await msg.async_send(error_msg, tag=True)
+                self.planner.reconcile()
+            except Exception as e:
+                root.exception(f"Error planning from the stored schedule: {str(e)}")
+            return
 
-                    else:
-                        message = f'No matches today for {team}.'
-                        root.info(message)
-                        await msg.async_send(message)
+        upcoming = self.planner.timeline(until=datetime.now().astimezone() + timedelta(days=2))
+        if upcoming:
+            summary.append('Planned in the next 48 hours:')
+            summary.extend(str(job) for job in upcoming)
+        else:
+            summary.append('No threads planned in the next 48 hours.')
+        await msg.async_send("\n".join(summary))
 
-                else:
-                    message = f'No matches today for {team}.'
-                    root.info(message)
-                    await msg.async_send(message)
+    async def schedule_check(self):
+        """Pick up kickoff changes between daily setups"""
+        try:
+            message = await self.refresh_schedule(full=False)
+        except Exception as e:
+            root.exception(f"Error refreshing schedule: {str(e)}")
+            return
+        root.info(message)
 
-            except MLSApiClientError as e:
-                root.exception(f"Error fetching data for team {team}: {str(e)}")
-                await msg.async_send(f"Error fetching data for team {team}: {str(e)}")
-            except Exception as e:
-                root.exception(f"Error in daily setup for team {team}: {str(e)}")
-                await msg.async_send(f"Error in daily setup for team {team}: {str(e)}", True)
-    
     def setup_jobs(self):
         """Setup all scheduled jobs based on feature flags"""
-        if FEATURE_FLAGS['enable_widgets']:
+        # heavy nightly jobs run in worker processes, off the event loop
+        if FEATURE_FLAGS['enable_widgets'] and self.widget_source == 'renderer':
+            self.scheduler.add_job(
+                self.workers.run,
+                CronTrigger(hour=0, minute=45),
+                args=['widget_renderer:main'],
+                kwargs={'timeout': 300, 'memory_mb': WORKER_MEMORY_MB},
+                id='widget_renderer',
+                name='widget_renderer'
+            )
+        elif FEATURE_FLAGS['enable_widgets']:
             self.scheduler.add_job(
-                mls_playwright.main,
+                self.workers.run,
                 CronTrigger(hour=0, minute=45),
+                args=['mls_playwright:main'],
+                # no memory limit: Chromium reserves far more address space than it uses
+                kwargs={'timeout': 600},
+                id='mls_playwright',
                 name='mls_playwright'
             )
+
+        if FEATURE_FLAGS['enable_widgets']:
+            # uploads are plain Reddit I/O and run in-process on the shared client
             self.scheduler.add_job(
-                widgets.main,
+                widgets.update_image_widgets,
                 CronTrigger(hour=1, minute=0),
+                args=[widgets.IMAGE_WIDGETS, self.subreddit],
+                id='widgets',
                 name='widgets'
             )
             
         if FEATURE_FLAGS['enable_injuries']:
             self.scheduler.add_job(
-                injuries.main,
+                self.workers.run,
                 CronTrigger(hour=1, minute=15),
+                args=['injuries:main'],
+                kwargs={'timeout': 300, 'memory_mb': WORKER_MEMORY_MB},
+                id='injuries',
                 name='injuries'
             )
             
         if FEATURE_FLAGS['enable_discipline']:
             self.scheduler.add_job(
-                discipline.main,
+                self.workers.run,
                 CronTrigger(hour=1, minute=15),
+                args=['discipline:main'],
+                kwargs={'timeout': 300, 'memory_mb': WORKER_MEMORY_MB},
+                id='discipline',
                 name='discipline'
             )
             
@@ -235,35 +230,60 @@ class AsyncController:
             self.scheduler.add_job(
                 self.daily_setup,
                 CronTrigger(hour=1, minute=30),
+                id='daily_setup',
                 name='daily_setup'
             )
-
-            # Check if we should run now
-            current_time = datetime.now()
-            target_time = current_time.replace(hour=1, minute=30)
-            
-            # If it's after 1:30 AM today, run now
-            if current_time.hour > 1 or (current_time.hour == 1 and current_time.minute >= 30):
-                self.scheduler.add_job(
-                    self.daily_setup,
-                    'date',  # Run once
-                    run_date=datetime.now(),
-                    name='daily_setup_catchup'
-                )
+            self.scheduler.add_job(
+                self.schedule_check,
+                IntervalTrigger(hours=FEATURE_FLAGS.get('schedule_check_hours', 3)),
+                id='schedule_check',
+                name='schedule_check'
+            )
+            # plan from the stored schedule right away; the API is only
+            # queried at startup when there is no stored schedule yet
+            if len(schedule_index.get_index()):
+                startup_job, name = self.planner.reconcile, 'planner_startup'
+            else:
+                startup_job, name = self.daily_setup, 'daily_setup_catchup'
+            self.scheduler.add_job(
+                startup_job,
+                'date',  # Run once
+                run_date=datetime.now(),
+                id=name,
+                name=name
+            )
     
     async def run(self):
         """Main run loop"""
+        await msg.notifier.start()
         message = f'Started controller at {time.time()}. Subreddit {self.subreddit}\n{str(FEATURE_FLAGS)}'
         root.info(message)
         await msg.async_send(message, tag=True)
 
+        server = None
+        monitor = LoopMonitor(
+            threshold=FEATURE_FLAGS.get('loop_stall_threshold', 0.25),
+            debug=FEATURE_FLAGS.get('enable_loop_debug', False)
+        )
+        monitor.start()
+        reddit = reddit_client.get_client()
         try:
+            # one Reddit session and OAuth token for every thread and widget job
+            await reddit.start()
+            # parse the data files once up front so match threads start warm
+            await asyncio.to_thread(datasets.get_cache().preload)
             self.setup_jobs()
             self.scheduler.start()
+            try:
+                server = await metrics.start_server(port=FEATURE_FLAGS.get('metrics_port', 9108))
+            except OSError as e:
+                # metrics are optional; e.g. the port is already in use
+                message = f'Could not start metrics server, continuing without it: {str(e)}'
+                root.error(message)
+                await msg.async_send(message, tag=True)
 
             # Keep running until interrupted
-            while True:
-                await asyncio.sleep(300)
+            await asyncio.Event().wait()
 
         except (KeyboardInterrupt, asyncio.CancelledError):
             message = "Received interrupt "
@@ -275,6 +295,12 @@ class AsyncController:
             root.info(message)
             msg.send(message)
             self.scheduler.shutdown()
+            monitor.stop()
+            if server is not None:
+                await server.cleanup()
+            await file_manager.save()
+            await reddit.stop()
+            await msg.notifier.stop()
 
 async def main():
     args = parser.parse_args()
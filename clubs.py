@@ -0,0 +1,155 @@
+"""
+Club name resolution.
+
+Every club's full name, short name, abbreviation and known aliases are
+folded (accents stripped, case-folded, punctuation dropped) into one
+index, so a scraped label resolves with a dict lookup. Labels with extra
+trailing text ("St. Louis CITY SC (3)") fall back to the longest indexed
+name that prefixes the label on a word boundary, found with a trie, and
+reordered labels ("Red Bull New York") to the club whose full or short
+name has the most words, all of them in the label.
+"""
+from dataclasses import dataclass
+import re
+import unicodedata
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from util import names
+
+# extra labels seen on mlssoccer.com and in the stats APIs
+ALIASES: Dict[int, List[str]] = {
+    11091: ['Atlanta United FC'],
+    1616: ['Montreal Impact', 'CF Montreal'],
+    1207: ['Chicago Fire'],
+    1897: ['Houston Dynamo'],
+    1230: ['LAG', 'Galaxy'],
+    454: ['Columbus Crew SC'],
+    11690: ['LAFC'],
+    1326: ['DC United', 'DCU'],
+    6977: ['Minnesota United FC', 'MNUFC'],
+    14880: ['Inter Miami'],
+    1131: ['SJE'],
+    928: ['New England Revs', 'NER'],
+    9668: ['NYCFC'],
+    3500: ['Seattle Sounders'],
+    399: ['Red Bull New York', 'NY Red Bulls', 'NYRB', 'Red Bulls'],
+    421: ['Sporting KC', 'SKC'],
+    6900: ['Orlando City SC'],
+    17012: ['St. Louis CITY SC', 'St Louis City', 'STL CITY'],
+    1708: ['Vancouver Whitecaps'],
+    12125: ['Red Bull New York II'],
+}
+
+_PUNCTUATION = re.compile(r"[.,'’()\-]")
+_SPACES = re.compile(r'\s+')
+
+
+def normalize(label: str) -> str:
+    """Fold a club label for comparison: no accents, case or punctuation."""
+    decomposed = unicodedata.normalize('NFKD', label)
+    stripped = ''.join(c for c in decomposed if not unicodedata.combining(c))
+    folded = _PUNCTUATION.sub(' ', stripped.casefold().replace('&', ' and '))
+    return _SPACES.sub(' ', folded).strip()
+
+
+@dataclass(frozen=True)
+class Club:
+    opta_id: int
+    full_name: str
+    short_name: str
+    abbrev: str
+    sportec_id: Optional[str]
+
+
+class ClubResolver:
+    _END = ''
+
+    def __init__(self, clubs: Dict[int, tuple] = names, aliases: Dict[int, List[str]] = ALIASES):
+        self._by_opta: Dict[int, Club] = {}
+        self._by_sportec: Dict[str, Club] = {}
+        self._index: Dict[str, Club] = {}
+        self._trie: Dict = {}
+        self._words: List[Tuple[FrozenSet[str], Club]] = []
+        for opta_id, entry in clubs.items():
+            club = Club(opta_id, entry.full_name, entry.short_name, entry.abbrev, entry.sportec_id or None)
+            self._by_opta[opta_id] = club
+            if club.sportec_id:
+                self._by_sportec[club.sportec_id] = club
+        # earlier kinds win when two clubs fold to the same key
+        self._add_all((club.full_name, club) for club in self._by_opta.values())
+        self._add_all((club.short_name, club) for club in self._by_opta.values())
+        self._add_all(
+            (alias, self._by_opta[opta_id])
+            for opta_id, labels in aliases.items() if opta_id in self._by_opta
+            for alias in labels
+        )
+        self._add_all((club.abbrev, club) for club in self._by_opta.values())
+        for club in self._by_opta.values():
+            for label in {normalize(club.full_name), normalize(club.short_name)} - {''}:
+                self._words.append((frozenset(label.split()), club))
+
+    def _add_all(self, labels: Iterable[tuple]) -> None:
+        for label, club in labels:
+            key = normalize(label)
+            if not key or key in self._index:
+                continue
+            self._index[key] = club
+            node = self._trie
+            for char in key:
+                node = node.setdefault(char, {})
+            node[self._END] = club
+
+    def resolve(self, label: str) -> Optional[Club]:
+        """Return the club a scraped label refers to, or None."""
+        key = normalize(label)
+        club = self._index.get(key)
+        if club is not None:
+            return club
+        return self._longest_prefix(key) or self._most_words(key)
+
+    def _longest_prefix(self, key: str) -> Optional[Club]:
+        node = self._trie
+        best = None
+        for i, char in enumerate(key):
+            node = node.get(char)
+            if node is None:
+                break
+            # only accept whole words: "la" must not match "lafc"
+            if self._END in node and (i + 1 == len(key) or key[i + 1] == ' '):
+                best = node[self._END]
+        return best
+
+    def _most_words(self, key: str) -> Optional[Club]:
+        words = set(key.split())
+        matches = [(len(name), club) for name, club in self._words if name <= words]
+        if not matches:
+            return None
+        most = max(size for size, _ in matches)
+        best = {club for size, club in matches if size == most}
+        # two clubs with equally good names is a guess, not a match
+        return best.pop() if len(best) == 1 else None
+
+    def opta_id(self, label: str) -> Optional[int]:
+        club = self.resolve(label)
+        return club.opta_id if club else None
+
+    def by_opta(self, opta_id: int) -> Optional[Club]:
+        return self._by_opta.get(int(opta_id))
+
+    def by_sportec(self, sportec_id: str) -> Optional[Club]:
+        return self._by_sportec.get(sportec_id)
+
+    def sportec_to_opta(self, sportec_id: str) -> Optional[str]:
+        """Return the opta ID (as the string used in data files) for a sportec club ID."""
+        club = self._by_sportec.get(sportec_id)
+        return str(club.opta_id) if club else None
+
+
+_resolver: Optional[ClubResolver] = None
+
+
+def get_resolver() -> ClubResolver:
+    global _resolver
+    if _resolver is None:
+        _resolver = ClubResolver()
+    return _resolver
@@ -16,6 +16,25 @@ FEATURE_FLAGS = {
     'enable_daily_setup':  True,
     # Enable inline club logos in match thread headers
     'enable_inline_logos': False,
+    # Record every match refresh in the local snapshot warehouse
+    'enable_match_warehouse': True,
+    # Hours between schedule checks for kickoff changes
+    'schedule_check_hours': 3,
+    # Port for the Prometheus /metrics endpoint
+    'metrics_port': 9108,
+    # Seconds the event loop may be blocked before its stack is captured to log/loop_stalls.log
+    'loop_stall_threshold': 0.25,
+    # Run the loop in asyncio debug mode and report slow callbacks (adds overhead)
+    'enable_loop_debug': False,
+    # Abort third-party, media and tracking requests when taking screenshots
+    'playwright_block_requests': True,
+    # Domains (and subdomains) screenshot pages may load resources from
+    'playwright_allowed_domains': ['mlssoccer.com', 'cookielaw.org', 'onetrust.com'],
+    # Widget images: 'renderer' draws them from API data (and refreshes after
+    # each match), 'playwright' screenshots mlssoccer.com
+    'widget_source': 'playwright',
+    # Per-widget layout overrides for the renderer, e.g. {'Western Conference': {'row_height': 40}}
+    'widget_layouts': {},
     # Schedule times (24h format)
     'schedule_times': {
         'selenium': '00:45',
@@ -0,0 +1,300 @@
+"""
+Versioned store and in-memory cache for scraped datasets (injuries,
+discipline, ...).
+
+Each dataset version is kept with a content hash of its canonical JSON, so
+change detection is a hash comparison, plus a typed per-team diff against
+the previous version. Payloads are stored zlib-compressed.
+
+``DatasetCache`` serves the current data files to match threads, reloading
+a file only when its mtime or size changes.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Set, Tuple
+import zlib
+
+import db
+import util
+
+logger = logging.getLogger(__name__)
+
+DATASETS_DB = 'data/datasets.db'
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS dataset_versions (
+        dataset TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        content_hash TEXT NOT NULL,
+        created REAL NOT NULL,
+        diff TEXT NOT NULL,
+        payload BLOB NOT NULL,
+        PRIMARY KEY (dataset, version)
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_dataset_created ON dataset_versions (dataset, created)',
+]
+
+
+@dataclass
+class TeamDiff:
+    """Entries added to and removed from one team's list"""
+    added: List[str] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.removed)
+
+
+@dataclass
+class DatasetDiff:
+    """Per-team changes between two versions of a dataset, keyed by opta ID"""
+    dataset: str
+    from_version: Optional[int]
+    to_version: int
+    teams: Dict[str, TeamDiff] = field(default_factory=dict)
+
+    def __bool__(self) -> bool:
+        return bool(self.teams)
+
+    def to_dict(self) -> Dict:
+        return {team: {'added': d.added, 'removed': d.removed} for team, d in self.teams.items()}
+
+    def __str__(self) -> str:
+        lines = [f'{self.dataset} v{self.from_version} -> v{self.to_version}']
+        for team, d in self.teams.items():
+            lines.extend(f'{team}: + {entry}' for entry in d.added)
+            lines.extend(f'{team}: - {entry}' for entry in d.removed)
+        return '\n'.join(lines)
+
+
+@dataclass
+class DatasetVersion:
+    dataset: str
+    version: int
+    content_hash: str
+    created: datetime
+    data: Dict
+
+
+def canonical(data: Any) -> str:
+    return json.dumps(data, sort_keys=True, separators=(',', ':'), ensure_ascii=False)
+
+
+def content_hash(data: Any) -> str:
+    return hashlib.sha256(canonical(data).encode('utf-8')).hexdigest()
+
+
+def _entries(value: Any) -> Set[str]:
+    """Flatten one team's entry into comparable strings.
+
+    Lists (injuries) become their items; dicts of lists (discipline)
+    become ``'<category>: <item>'``.
+    """
+    if isinstance(value, dict):
+        return {f'{key}: {item}' for key, items in value.items() for item in _entries(items)}
+    if isinstance(value, (list, tuple)):
+        return {str(item) for item in value}
+    return {str(value)}
+
+
+def diff_teams(old: Optional[Dict], new: Dict) -> Dict[str, TeamDiff]:
+    """Typed per-team diff of two ``{team_id: entries}`` maps"""
+    old = old or {}
+    teams = {}
+    for team in sorted(set(old) | set(new), key=str):
+        before = _entries(old.get(team, []))
+        after = _entries(new.get(team, []))
+        d = TeamDiff(sorted(after - before), sorted(before - after))
+        if d:
+            teams[str(team)] = d
+    return teams
+
+
+class DatasetStore:
+    def __init__(self, path: str = DATASETS_DB):
+        self.db = db.get_database(path)
+        with self.db.transaction() as con:
+            for statement in SCHEMA:
+                con.execute(statement)
+
+    def record(self, dataset: str, data: Dict, teams_key: Optional[str] = None) -> Optional[DatasetDiff]:
+        """Store ``data`` as a new version if its content changed.
+
+        ``teams_key`` names the ``{team_id: entries}`` map inside ``data``
+        (default: the dataset name). Returns the diff against the previous
+        version, or None if nothing changed.
+        """
+        teams_key = teams_key or dataset
+        new_hash = content_hash(data)
+        with self.db.transaction() as con:
+            row = con.execute(
+                '''SELECT version, content_hash, payload FROM dataset_versions
+                   WHERE dataset = ? ORDER BY version DESC LIMIT 1''',
+                (dataset,)
+            ).fetchone()
+            if row is not None and row[1] == new_hash:
+                logger.debug(f'{dataset} unchanged')
+                return None
+            previous = self._decode(row[2]) if row else None
+            version = row[0] + 1 if row else 1
+            teams = diff_teams(previous.get(teams_key) if previous else None, data.get(teams_key, {}))
+            changes = DatasetDiff(dataset, row[0] if row else None, version, teams)
+            con.execute(
+                '''INSERT INTO dataset_versions (dataset, version, content_hash, created, diff, payload)
+                   VALUES (?, ?, ?, ?, ?, ?)''',
+                (dataset, version, new_hash, time.time(), canonical(changes.to_dict()),
+                 zlib.compress(canonical(data).encode('utf-8')))
+            )
+        logger.info(f'{dataset} v{version}: {len(teams)} teams changed')
+        return changes
+
+    async def async_record(self, dataset: str, data: Dict, teams_key: Optional[str] = None) -> Optional[DatasetDiff]:
+        return await self.db.run(self.record, dataset, data, teams_key)
+
+    @staticmethod
+    def _decode(payload: bytes) -> Dict:
+        return json.loads(zlib.decompress(payload))
+
+    def _version(self, row) -> DatasetVersion:
+        dataset, version, hash_, created, payload = row
+        return DatasetVersion(dataset, version, hash_, datetime.fromtimestamp(created), self._decode(payload))
+
+    def latest(self, dataset: str) -> Optional[DatasetVersion]:
+        rows = self.db.execute(
+            '''SELECT dataset, version, content_hash, created, payload FROM dataset_versions
+               WHERE dataset = ? ORDER BY version DESC LIMIT 1''',
+            (dataset,)
+        )
+        return self._version(rows[0]) if rows else None
+
+    def version_at(self, dataset: str, when: datetime) -> Optional[DatasetVersion]:
+        """Return the version that was current at ``when``."""
+        rows = self.db.execute(
+            '''SELECT dataset, version, content_hash, created, payload FROM dataset_versions
+               WHERE dataset = ? AND created <= ? ORDER BY version DESC LIMIT 1''',
+            (dataset, when.timestamp())
+        )
+        return self._version(rows[0]) if rows else None
+
+    def history(self, dataset: str, limit: int = 20) -> List[DatasetDiff]:
+        """Return the most recent per-version diffs, newest first."""
+        rows = self.db.execute(
+            '''SELECT version, diff FROM dataset_versions
+               WHERE dataset = ? ORDER BY version DESC LIMIT ?''',
+            (dataset, limit)
+        )
+        diffs = []
+        for version, diff in rows:
+            teams = {team: TeamDiff(d['added'], d['removed']) for team, d in json.loads(diff).items()}
+            diffs.append(DatasetDiff(dataset, version - 1 if version > 1 else None, version, teams))
+        return diffs
+
+    def changes_since(self, dataset: str, since: datetime, teams_key: Optional[str] = None) -> Optional[DatasetDiff]:
+        """Diff the version current at ``since`` against the latest one.
+
+        E.g. ``changes_since('injuries', last_matchday_kickoff)``.
+        """
+        teams_key = teams_key or dataset
+        latest = self.latest(dataset)
+        if latest is None:
+            return None
+        base = self.version_at(dataset, since)
+        if base is not None and base.version == latest.version:
+            return DatasetDiff(dataset, base.version, latest.version)
+        teams = diff_teams(base.data.get(teams_key) if base else None, latest.data.get(teams_key, {}))
+        return DatasetDiff(dataset, base.version if base else None, latest.version, teams)
+
+
+def freeze(value: Any) -> Any:
+    """Return a read-only copy: dicts become mapping proxies, lists tuples."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
+
+
+EMPTY: Mapping = MappingProxyType({})
+
+
+class DatasetCache:
+    """Process-wide cache of JSON data files, validated by mtime and size
+
+    Callers get immutable views, so one parsed copy is shared safely by
+    every match thread.
+    """
+    def __init__(self):
+        self._entries: Dict[str, Tuple[Tuple[int, int], Mapping]] = {}
+        self._lock = threading.Lock()
+
+    def load(self, path: str) -> Optional[Mapping]:
+        """Return the parsed file, re-reading it only if it changed on disk."""
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return None
+        stamp = (st.st_mtime_ns, st.st_size)
+        entry = self._entries.get(path)
+        if entry is not None and entry[0] == stamp:
+            return entry[1]
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None and entry[0] == stamp:
+                return entry[1]
+            data = freeze(util.read_json(path))
+            self._entries[path] = (stamp, data)
+        logger.debug(f'Loaded {path}')
+        return data
+
+    def teams(self, path: str, key: str) -> Mapping[str, Any]:
+        """Return the ``{opta_id: entries}`` map stored under ``key``."""
+        data = self.load(path)
+        if data is None:
+            logger.warning(f"{path} not found, skipping {key} data")
+            return EMPTY
+        return data.get(key, EMPTY)
+
+    def injuries(self) -> Mapping[str, Tuple[str, ...]]:
+        return self.teams(_data_files()[0], 'injuries')
+
+    def discipline(self) -> Mapping[str, Mapping[str, Tuple[str, ...]]]:
+        return self.teams(_data_files()[1], 'discipline')
+
+    def preload(self, *paths: str) -> None:
+        for path in paths or _data_files():
+            try:
+                self.load(path)
+            except (OSError, ValueError) as e:
+                logger.warning(f'Could not preload {path}: {e}')
+
+
+def _data_files() -> Tuple[str, str]:
+    """The injuries and discipline files, as written by their scrapers"""
+    # imported here: both scrapers import this module
+    from discipline import DISC_FILE
+    from injuries import INJ_FILE
+    return INJ_FILE, DISC_FILE
+
+
+_cache = DatasetCache()
+
+
+def get_cache() -> DatasetCache:
+    return _cache
+
+
+_store: Optional[DatasetStore] = None
+
+
+def get_store() -> DatasetStore:
+    global _store
+    if _store is None:
+        _store = DatasetStore()
+    return _store
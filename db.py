@@ -0,0 +1,162 @@
+"""
+SQLite access layer with one persistent WAL-mode connection per thread.
+"""
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import functools
+import logging
+import os
+import sqlite3
+import threading
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+
+class Database:
+    """A SQLite database shared across threads.
+
+    Each thread gets its own long-lived connection, opened in WAL mode so
+    readers never block the writer. Compiled statements are kept in the
+    per-connection statement cache (``cached_statements``), so repeating a
+    query only pays for binding. The ``async_*`` methods run on a small
+    dedicated executor so callers on the event loop never touch the disk.
+    """
+    def __init__(self, path: str, cached_statements: int = 256, timeout: float = 30, max_workers: int = 2):
+        self.path = path
+        self.cached_statements = cached_statements
+        self.timeout = timeout
+        self.max_workers = max_workers
+        self._local = threading.local()
+        self._connections: List[sqlite3.Connection] = []
+        self._connections_lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def connection(self) -> sqlite3.Connection:
+        """Return this thread's connection, opening it on first use."""
+        con = getattr(self._local, 'connection', None)
+        if con is None:
+            dir_name = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(dir_name, exist_ok=True)
+            con = sqlite3.connect(
+                self.path,
+                timeout=self.timeout,
+                cached_statements=self.cached_statements,
+                isolation_level=None,
+                check_same_thread=False
+            )
+            con.execute('PRAGMA journal_mode=WAL')
+            con.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = con
+            self._local.depth = 0
+            with self._connections_lock:
+                self._connections.append(con)
+        return con
+
+    def execute(self, query: str, data: Optional[Sequence[Any]] = None) -> List[tuple]:
+        """Run one statement and return all resulting rows."""
+        con = self.connection()
+        try:
+            cur = con.execute(query, data) if data is not None else con.execute(query)
+            logger.debug(query)
+            if cur.rowcount > -1:
+                logger.debug(f'{cur.rowcount} rows affected.')
+            return cur.fetchall()
+        except Exception as e:
+            logger.error(f'Database error: {str(e)}\nQuery: {query}')
+            raise
+
+    def executemany(self, query: str, rows: Iterable[Sequence[Any]]) -> int:
+        """Run one statement for every row in a single transaction.
+
+        Returns the number of rows affected.
+        """
+        with self.transaction() as con:
+            try:
+                cur = con.executemany(query, rows)
+            except Exception as e:
+                logger.error(f'Database error: {str(e)}\nQuery: {query}')
+                raise
+            logger.debug(f'{cur.rowcount} rows affected.')
+            return cur.rowcount
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Group several statements into one transaction.
+
+        Nested use on the same thread joins the outer transaction.
+        """
+        con = self.connection()
+        if self._local.depth > 0:
+            self._local.depth += 1
+            try:
+                yield con
+            finally:
+                self._local.depth -= 1
+            return
+        con.execute('BEGIN IMMEDIATE')
+        self._local.depth = 1
+        try:
+            yield con
+        except BaseException:
+            con.execute('ROLLBACK')
+            raise
+        else:
+            con.execute('COMMIT')
+        finally:
+            self._local.depth = 0
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix=f'db-{os.path.basename(self.path)}'
+            )
+        return self._executor
+
+    async def run(self, func: Callable, *args, **kwargs) -> Any:
+        """Run ``func(*args, **kwargs)`` on the database executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._get_executor(), functools.partial(func, *args, **kwargs))
+
+    async def async_execute(self, query: str, data: Optional[Sequence[Any]] = None) -> List[tuple]:
+        return await self.run(self.execute, query, data)
+
+    async def async_executemany(self, query: str, rows: Iterable[Sequence[Any]]) -> int:
+        # materialise generators here; they may not be thread-safe
+        return await self.run(self.executemany, query, list(rows))
+
+    async def async_transaction(self, func: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Run ``func(connection)`` inside a transaction on the executor."""
+        def _run():
+            with self.transaction() as con:
+                return func(con)
+        return await self.run(_run)
+
+    def close(self) -> None:
+        """Close every connection and stop the executor."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        with self._connections_lock:
+            for con in self._connections:
+                try:
+                    con.close()
+                except sqlite3.Error as e:
+                    logger.warning(f'Error closing connection to {self.path}: {e}')
+            self._connections.clear()
+        self._local = threading.local()
+
+
+# one Database per file, shared across the process
+_databases: Dict[str, Database] = {}
+_databases_lock = threading.Lock()
+
+
+def get_database(path: str) -> Database:
+    key = os.path.abspath(path)
+    with _databases_lock:
+        if key not in _databases:
+            _databases[key] = Database(path)
+        return _databases[key]
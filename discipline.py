@@ -5,8 +5,10 @@ import re
 import logging
 from typing import Optional
 
+import clubs
+import datasets
+import discord as msg
 import util
-from util import names
 
 logger = logging.getLogger(__name__)
 
@@ -130,20 +132,15 @@ def parse_discipline(soup: BeautifulSoup):
 
 
 def match_teams(disc_obj):
-    """Returns a dict with team opta ID as key, injury list as value"""
-    teams = names.items()
+    """Returns a dict with team opta ID as key, discipline dict as value"""
+    resolver = clubs.get_resolver()
     opta_disc = {}
-
-    for item in disc_obj.items():
-        team = item[0]
-        for t in teams:
-            if team.lower() == t[1][0].lower():
-                opta_disc[t[0]] = item[1]
-                break
-            if t[1][2].lower() in team.lower():
-                opta_disc[t[0]] = item[1]
-                break
-    
+    for team, team_disc in disc_obj.items():
+        opta_id = resolver.opta_id(team)
+        if opta_id is None:
+            logger.warning(f'Could not match discipline team "{team}"')
+            continue
+        opta_disc[opta_id] = team_disc
     return opta_disc
 
 
@@ -153,8 +150,18 @@ def main():
         logger.error("Could not fetch discipline content, skipping update")
         return False
     disc_obj = populate_discipline(soup)
-    util.write_json(disc_obj.to_dict(), DISC_FILE)
-    return util.file_changed(DISC_FILE)
+    data = disc_obj.to_dict()
+    util.write_json(data, DISC_FILE)
+    changes = datasets.get_store().record('discipline', data)
+    if changes is None:
+        message = f'No changes to {DISC_FILE}.'
+        logger.info(message)
+        msg.send(message)
+        return False
+    message = f'{DISC_FILE} changed.\n{str(changes)[:1500]}'
+    logger.info(message)
+    msg.send(message, tag=True)
+    return True
 
 
 if __name__ == '__main__':
@@ -1,7 +1,10 @@
 import aiohttp
+import asyncio
 import json
 import logging
 import requests
+import time
+from typing import Dict, List, Optional
 
 import config as conf
 
@@ -15,8 +18,211 @@ HEADERS = {
     "Content-Type":"application/json"
 }
 
+# Discord rejects message content longer than this
+MAX_CONTENT = 2000
+
+
+def format_message(message, tag=False) -> str:
+    return f'[{conf.HOST}] {f"{user}: " if tag else ""}{message}'
+
+
+class Notifier:
+    """Batched webhook dispatcher running on the event loop
+
+    Messages are queued without blocking, coalesced for ``window`` seconds
+    into as few webhook posts as fit Discord's length limit, and identical
+    messages repeated within ``dedupe_window`` seconds are dropped. Posts
+    wait out Discord's rate-limit headers and retry on 429.
+    """
+    def __init__(
+        self,
+        url: str = conf.MLS_BOT_WEBHOOK,
+        headers: Dict[str, str] = HEADERS,
+        window: float = 2.0,
+        maxsize: int = 500,
+        dedupe_window: float = 60.0,
+        max_retries: int = 3
+    ):
+        self.url = url
+        self.headers = headers
+        self.window = window
+        self.maxsize = maxsize
+        self.dedupe_window = dedupe_window
+        self.max_retries = max_retries
+        self.dropped = 0
+        self._queue: Optional[asyncio.Queue] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._task: Optional[asyncio.Task] = None
+        self._recent: Dict[str, float] = {}
+        self._stopping = False
+        # monotonic time before which the webhook bucket is exhausted
+        self._blocked_until = 0.0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done() and not self._stopping
+
+    async def start(self) -> None:
+        if self.running:
+            return
+        self._loop = asyncio.get_running_loop()
+        self._stopping = False
+        self._queue = asyncio.Queue(maxsize=self.maxsize)
+        self._session = aiohttp.ClientSession(headers=self.headers, timeout=aiohttp.ClientTimeout(total=10))
+        self._task = asyncio.create_task(self._run(), name='discord_notifier')
+
+    async def stop(self, timeout: float = 30.0) -> None:
+        """Deliver whatever is queued, then close the session.
+
+        The worker finishes its current post and drains the queue rather
+        than being cancelled mid-post (which would send a batch twice);
+        it is only cancelled if that takes longer than ``timeout``.
+        """
+        if self._task is None:
+            return
+        # later messages go out directly, not into a queue nobody reads
+        self._stopping = True
+        if not self._task.done():
+            await self._queue.put(None)
+            try:
+                await asyncio.wait_for(asyncio.shield(self._task), timeout)
+            except asyncio.TimeoutError:
+                logger.warning(f'Discord notifier did not drain within {timeout}s, dropping the rest')
+                self._task.cancel()
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+        await self._session.close()
+        self._task = None
+        self._loop = None
+
+    def send(self, text: str) -> bool:
+        """Queue a formatted message from any thread; never blocks.
+
+        Returns False if the notifier is not running.
+        """
+        loop = self._loop
+        if loop is None or loop.is_closed() or not self.running:
+            return False
+        try:
+            loop.call_soon_threadsafe(self._enqueue, text)
+        except RuntimeError:
+            return False
+        return True
+
+    def _enqueue(self, text: str) -> None:
+        now = time.monotonic()
+        last = self._recent.get(text)
+        if last is not None and now - last < self.dedupe_window:
+            return
+        self._recent[text] = now
+        if len(self._recent) > self.maxsize:
+            self._recent = {k: t for k, t in self._recent.items() if now - t < self.dedupe_window}
+        try:
+            self._queue.put_nowait(text)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning(f'Discord queue full, dropped message ({self.dropped} dropped so far)')
+
+    def _drain(self) -> List[str]:
+        messages = []
+        while not self._queue.empty():
+            messages.append(self._queue.get_nowait())
+        return messages
+
+    async def _run(self) -> None:
+        # None on the queue asks the worker to deliver what is left and exit
+        stopping = False
+        while not stopping:
+            first = await self._queue.get()
+            if first is not None:
+                await asyncio.sleep(self.window)
+            messages = [first] + self._drain()
+            stopping = None in messages
+            messages = [text for text in messages if text is not None]
+            if not messages:
+                continue
+            try:
+                await self._deliver(messages)
+            except Exception as e:
+                logger.error(f"Discord webhook send failed: {e}")
+
+    async def _deliver(self, messages: List[str]) -> None:
+        for content in batch(messages):
+            await self._post(content)
+
+    async def _post(self, content: str) -> None:
+        for _ in range(self.max_retries + 1):
+            delay = self._blocked_until - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            try:
+                async with self._session.post(self.url, data=json.dumps({'content': content})) as r:
+                    self._note_rate_limit(r.headers)
+                    if r.status != 429:
+                        if r.status >= 400:
+                            logger.error(f"Discord webhook send failed: HTTP {r.status}")
+                        return
+                    retry_after = _float(r.headers.get('Retry-After'))
+                    try:
+                        retry_after = float((await r.json()).get('retry_after', retry_after))
+                    except (aiohttp.ContentTypeError, ValueError, AttributeError):
+                        pass
+                    logger.warning(f'Discord rate limited, retrying in {retry_after}s')
+                    self._blocked_until = max(self._blocked_until, time.monotonic() + (retry_after or 1.0))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                logger.error(f"Discord async webhook send failed: {e}")
+                return
+        logger.error('Discord webhook send failed: still rate limited after retries')
+
+    def _note_rate_limit(self, headers) -> None:
+        if headers.get('X-RateLimit-Remaining') == '0':
+            reset_after = _float(headers.get('X-RateLimit-Reset-After'))
+            if reset_after:
+                self._blocked_until = max(self._blocked_until, time.monotonic() + reset_after)
+
+
+def _float(value) -> Optional[float]:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def batch(messages: List[str], limit: int = MAX_CONTENT) -> List[str]:
+    """Join messages into as few posts as fit ``limit``, folding repeats."""
+    counts: Dict[str, int] = {}
+    for message in messages:
+        counts[message] = counts.get(message, 0) + 1
+    lines = [m if n == 1 else f'{m} (x{n})' for m, n in counts.items()]
+
+    posts: List[str] = []
+    current = ''
+    for line in lines:
+        line = line[:limit]
+        if current and len(current) + 1 + len(line) > limit:
+            posts.append(current)
+            current = ''
+        current = f'{current}\n{line}' if current else line
+    if current:
+        posts.append(current)
+    return posts
+
+
+notifier = Notifier()
+
+
 def send(message, tag=False, url=conf.MLS_BOT_WEBHOOK, headers=HEADERS):
-    message = f'[{conf.HOST}] {f"{user}: " if tag else ""}{message}'
+    """Send a message without blocking when the notifier is running
+
+    Outside a running notifier (scripts, tests) this falls back to a direct
+    blocking post.
+    """
+    message = format_message(message, tag)
+    if url == notifier.url and notifier.send(message):
+        return None
     content = json.dumps({'content': message})
     try:
         r = requests.post(url, headers=headers, data=content, timeout=10)
@@ -26,7 +232,9 @@ def send(message, tag=False, url=conf.MLS_BOT_WEBHOOK, headers=HEADERS):
         return None
 
 async def async_send(message, tag=False, url=conf.MLS_BOT_WEBHOOK, headers=HEADERS):
-    message = f'[{conf.HOST}] {f"{user}: " if tag else ""}{message}'
+    message = format_message(message, tag)
+    if url == notifier.url and notifier.send(message):
+        return None
     content = json.dumps({'content': message})
     try:
         async with aiohttp.ClientSession() as session:
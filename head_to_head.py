@@ -0,0 +1,224 @@
+"""
+Persisted head-to-head index, keyed by unordered club pair.
+
+Meetings come from ``Match_Base.last_matches`` and from finished matches,
+so pre-match threads can show previous matchups without an API call.
+"""
+from dataclasses import dataclass
+import logging
+from typing import Iterable, List, Optional, Tuple
+
+import db
+from models.match import BasicMatch, Match_Base
+import util
+
+logger = logging.getLogger(__name__)
+
+H2H_DB = 'data/head_to_head.db'
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS h2h_matches (
+        match_id TEXT PRIMARY KEY,
+        pair TEXT NOT NULL,
+        match_date TEXT NOT NULL,
+        home_team_id TEXT NOT NULL,
+        home_team_name TEXT,
+        away_team_id TEXT NOT NULL,
+        away_team_name TEXT,
+        home_goals INTEGER NOT NULL,
+        away_goals INTEGER NOT NULL,
+        competition_id TEXT
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_h2h_pair_date ON h2h_matches (pair, match_date)',
+    '''CREATE TABLE IF NOT EXISTS h2h_records (
+        pair TEXT PRIMARY KEY,
+        team_a TEXT NOT NULL,
+        team_b TEXT NOT NULL,
+        played INTEGER NOT NULL DEFAULT 0,
+        a_wins INTEGER NOT NULL DEFAULT 0,
+        b_wins INTEGER NOT NULL DEFAULT 0,
+        draws INTEGER NOT NULL DEFAULT 0,
+        a_goals INTEGER NOT NULL DEFAULT 0,
+        b_goals INTEGER NOT NULL DEFAULT 0
+    )''',
+]
+
+
+@dataclass
+class Meeting:
+    """A single previous meeting between two clubs"""
+    match_id: str
+    match_date: str
+    home_team_id: str
+    home_team_name: Optional[str]
+    away_team_id: str
+    away_team_name: Optional[str]
+    home_goals: int
+    away_goals: int
+    competition_id: Optional[str] = None
+
+
+@dataclass
+class HeadToHeadRecord:
+    """Aggregate record between two clubs, from ``team_id``'s point of view"""
+    team_id: str
+    opponent_id: str
+    played: int
+    wins: int
+    draws: int
+    losses: int
+    goals_for: int
+    goals_against: int
+
+
+def _normalize_date(value: str) -> str:
+    """Store dates as UTC ISO strings so they sort consistently."""
+    try:
+        return util.normalize_datetime(value).isoformat()
+    except ValueError:
+        return value
+
+
+def pair_key(team_a: str, team_b: str) -> Tuple[str, str, str]:
+    """Return ``(key, first, second)`` with the two IDs in sorted order."""
+    first, second = sorted((team_a, team_b))
+    return f'{first}|{second}', first, second
+
+
+class HeadToHeadIndex:
+    def __init__(self, path: str = H2H_DB):
+        self.db = db.get_database(path)
+        with self.db.transaction() as con:
+            for statement in SCHEMA:
+                con.execute(statement)
+
+    def add_matches(self, matches: Iterable[BasicMatch]) -> int:
+        """Index finished meetings, skipping any already known.
+
+        Returns the number of new meetings added.
+        """
+        added = 0
+        with self.db.transaction() as con:
+            for m in matches:
+                if not (m.match_id and m.home_team_id and m.away_team_id and m.match_date):
+                    continue
+                if m.home_team_goals is None or m.away_team_goals is None:
+                    continue
+                key, first, _ = pair_key(m.home_team_id, m.away_team_id)
+                match_date = _normalize_date(m.match_date)
+                cur = con.execute(
+                    '''INSERT OR IGNORE INTO h2h_matches
+                       (match_id, pair, match_date, home_team_id, home_team_name,
+                        away_team_id, away_team_name, home_goals, away_goals, competition_id)
+                       VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+                    (m.match_id, key, match_date, m.home_team_id, m.home_team_name,
+                     m.away_team_id, m.away_team_name, m.home_team_goals, m.away_team_goals,
+                     m.competition_id)
+                )
+                if cur.rowcount != 1:
+                    continue
+                added += 1
+                self._add_to_record(con, key, m, first)
+        if added:
+            logger.debug(f'Indexed {added} new head-to-head meetings')
+        return added
+
+    def _add_to_record(self, con, key: str, m: BasicMatch, first: str) -> None:
+        # goals from the point of view of the first (sorted) team
+        if m.home_team_id == first:
+            a_goals, b_goals = m.home_team_goals, m.away_team_goals
+        else:
+            a_goals, b_goals = m.away_team_goals, m.home_team_goals
+        second = m.away_team_id if m.home_team_id == first else m.home_team_id
+        con.execute(
+            '''INSERT INTO h2h_records (pair, team_a, team_b, played, a_wins, b_wins, draws, a_goals, b_goals)
+               VALUES (?, ?, ?, 1, ?, ?, ?, ?, ?)
+               ON CONFLICT(pair) DO UPDATE SET
+                   played = played + 1,
+                   a_wins = a_wins + excluded.a_wins,
+                   b_wins = b_wins + excluded.b_wins,
+                   draws = draws + excluded.draws,
+                   a_goals = a_goals + excluded.a_goals,
+                   b_goals = b_goals + excluded.b_goals''',
+            (key, first, second, int(a_goals > b_goals), int(b_goals > a_goals),
+             int(a_goals == b_goals), a_goals, b_goals)
+        )
+
+    def add_finished_match(self, match_base: Match_Base) -> int:
+        """Index a finished match from its stats API base data."""
+        info = match_base.match_information
+        if info.match_status != 'finalWhistle' or info.planned_kickoff_time is None:
+            return 0
+        return self.add_matches([BasicMatch(
+            match_date=info.planned_kickoff_time.isoformat(),
+            home_team_id=match_base.home.team_id,
+            home_team_name=match_base.home.team_name,
+            away_team_id=match_base.away.team_id,
+            away_team_name=match_base.away.team_name,
+            home_team_goals=info.home_team_goals,
+            away_team_goals=info.away_team_goals,
+            match_id=info.match_id,
+            season_id=info.season_id,
+            competition_id=info.competition_id
+        )])
+
+    async def async_add_matches(self, matches: Iterable[BasicMatch]) -> int:
+        return await self.db.run(self.add_matches, list(matches))
+
+    async def async_add_finished_match(self, match_base: Match_Base) -> int:
+        return await self.db.run(self.add_finished_match, match_base)
+
+    def last_meetings(self, team_a: str, team_b: str, limit: int = 5, before: Optional[str] = None) -> List[Meeting]:
+        """Return the most recent meetings between two clubs, newest first.
+
+        ``before`` (an ISO date string) excludes meetings on or after it.
+        """
+        key, _, _ = pair_key(team_a, team_b)
+        rows = self.db.execute(
+            '''SELECT match_id, match_date, home_team_id, home_team_name, away_team_id,
+                      away_team_name, home_goals, away_goals, competition_id
+               FROM h2h_matches WHERE pair = ? AND match_date < ?
+               ORDER BY match_date DESC LIMIT ?''',
+            (key, before or '9999', limit)
+        )
+        return [Meeting(*row) for row in rows]
+
+    def record(self, team_id: str, opponent_id: str, before: Optional[str] = None) -> Optional[HeadToHeadRecord]:
+        """Return the aggregate record of ``team_id`` against ``opponent_id``.
+
+        ``before`` filters meetings like ``last_meetings``; the running
+        totals are only used when it is not given.
+        """
+        key, first, _ = pair_key(team_id, opponent_id)
+        if before is None:
+            rows = self.db.execute(
+                'SELECT played, a_wins, b_wins, draws, a_goals, b_goals FROM h2h_records WHERE pair = ?',
+                (key,)
+            )
+        else:
+            # goals from the point of view of the first (sorted) team
+            rows = self.db.execute(
+                '''SELECT COUNT(*), SUM(a_goals > b_goals), SUM(b_goals > a_goals), SUM(a_goals = b_goals),
+                          SUM(a_goals), SUM(b_goals)
+                   FROM (SELECT CASE WHEN home_team_id = ? THEN home_goals ELSE away_goals END AS a_goals,
+                                CASE WHEN home_team_id = ? THEN away_goals ELSE home_goals END AS b_goals
+                         FROM h2h_matches WHERE pair = ? AND match_date < ?)''',
+                (first, first, key, before)
+            )
+            rows = [row for row in rows if row[0]]
+        if not rows:
+            return None
+        played, a_wins, b_wins, draws, a_goals, b_goals = rows[0]
+        if team_id == first:
+            return HeadToHeadRecord(team_id, opponent_id, played, a_wins, draws, b_wins, a_goals, b_goals)
+        return HeadToHeadRecord(team_id, opponent_id, played, b_wins, draws, a_wins, b_goals, a_goals)
+
+
+_index: Optional[HeadToHeadIndex] = None
+
+
+def get_index() -> HeadToHeadIndex:
+    global _index
+    if _index is None:
+        _index = HeadToHeadIndex()
+    return _index
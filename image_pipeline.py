@@ -0,0 +1,136 @@
+"""
+In-memory processing of widget images.
+
+Screenshots (or rendered images) are padded, palette-quantised and
+optimised without touching disk, then written once to ``png/``. Each
+image's dimensions, size and perceptual difference hash (dHash) are kept
+in ``png/manifest.json`` along with the hash last uploaded to each
+subreddit, so an image that is visually unchanged is not uploaded again.
+"""
+from dataclasses import dataclass
+from datetime import datetime
+import hashlib
+import io
+import logging
+import os
+from typing import Dict, Optional
+
+from PIL import Image
+
+import util
+
+logger = logging.getLogger(__name__)
+
+PNG_DIR = 'png'
+MANIFEST = f'{PNG_DIR}/manifest.json'
+
+PADDING = 5
+COLORS = 256
+# downscale factor for the perceptual hash
+HASH_SCALE = 4
+
+
+@dataclass
+class ProcessedImage:
+    data: bytes
+    width: int
+    height: int
+    dhash: str
+
+    @property
+    def size(self) -> tuple[int, int]:
+        return self.width, self.height
+
+
+def dhash(im: Image.Image, scale: int = HASH_SCALE) -> str:
+    """Difference hash of ``im`` downscaled by ``scale``
+
+    One bit per horizontally adjacent pixel pair (is the left one
+    brighter?), digested to a short hex string. The classic 9x8 grid is
+    too coarse for tables of text, where a changed digit must count; at
+    1/4 scale the gradient signs still ignore re-encoding and
+    anti-aliasing noise.
+    """
+    width = max(2, im.width // scale)
+    height = max(1, im.height // scale)
+    small = im.convert('L').resize((width, height), Image.Resampling.BOX)
+    pixels = small.tobytes()
+    bits = bytearray()
+    for y in range(height):
+        row = pixels[y * width:(y + 1) * width]
+        bits.extend(left > right for left, right in zip(row, row[1:]))
+    return hashlib.sha1(f'{width}x{height}'.encode() + bytes(bits)).hexdigest()
+
+
+def pad(im: Image.Image, padding: int = PADDING, color=(255, 255, 255)) -> Image.Image:
+    padded = Image.new('RGB', (im.width + 2 * padding, im.height + 2 * padding), color)
+    padded.paste(im, (padding, padding))
+    return padded
+
+
+def process_image(im: Image.Image, padding: int = 0, colors: int = COLORS) -> ProcessedImage:
+    """Pad, quantise and optimise an image, returning the PNG bytes"""
+    im = im.convert('RGB')
+    if padding:
+        im = pad(im, padding)
+    quantized = im.quantize(colors=colors, method=Image.Quantize.MEDIANCUT, dither=Image.Dither.NONE)
+    buffer = io.BytesIO()
+    quantized.save(buffer, format='PNG', optimize=True)
+    return ProcessedImage(buffer.getvalue(), im.width, im.height, dhash(im))
+
+
+def process(data: bytes, padding: int = 0, colors: int = COLORS) -> ProcessedImage:
+    """``process_image`` for encoded image bytes (e.g. a Playwright screenshot)"""
+    with Image.open(io.BytesIO(data)) as im:
+        return process_image(im, padding, colors)
+
+
+def image_path(name: str, when: Optional[datetime] = None) -> str:
+    when = when or datetime.now()
+    return f'{PNG_DIR}/{name}-{when.month}-{when.day}.png'
+
+
+def read_manifest() -> Dict[str, Dict]:
+    if not os.path.exists(MANIFEST):
+        return {}
+    try:
+        return util.read_json(MANIFEST)
+    except ValueError as e:
+        logger.warning(f'Ignoring unreadable {MANIFEST}: {e}')
+        return {}
+
+
+def save(name: str, image: ProcessedImage) -> str:
+    """Write the image and record it in the manifest; returns the file path"""
+    path = image_path(name)
+    with open(path, 'wb') as f:
+        f.write(image.data)
+    manifest = read_manifest()
+    entry = manifest.setdefault(name, {})
+    entry.update({
+        'file': path,
+        'width': image.width,
+        'height': image.height,
+        'bytes': len(image.data),
+        'dhash': image.dhash,
+        'updated': datetime.now().isoformat(timespec='seconds'),
+    })
+    util.write_json(manifest, MANIFEST)
+    logger.info(f'Saved {path} ({image.width}x{image.height}, {len(image.data)} bytes, dhash {image.dhash})')
+    return path
+
+
+def get_entry(name: str) -> Optional[Dict]:
+    return read_manifest().get(name)
+
+
+def needs_upload(entry: Dict, subreddit: str) -> bool:
+    """True if the image differs visually from the one last uploaded to ``subreddit``"""
+    return entry.get('uploaded', {}).get(subreddit) != entry['dhash']
+
+
+def mark_uploaded(name: str, subreddit: str, image_hash: str) -> None:
+    manifest = read_manifest()
+    entry = manifest.setdefault(name, {})
+    entry.setdefault('uploaded', {})[subreddit] = image_hash
+    util.write_json(manifest, MANIFEST)
@@ -1,17 +1,23 @@
+import aiohttp
+import asyncio
+import hashlib
 import logging
 import re
-from typing import Dict, Optional
-import requests
+from typing import Dict, Optional, Tuple
 from datetime import datetime
 from bs4 import BeautifulSoup
 
+import clubs
+import datasets
 import util
-from util import names
 
 root = logging.getLogger('root')
 
 INJ_URL = 'https://www.mlssoccer.com/news/mlssoccer-com-injury-report'
 INJ_FILE = 'data/injuries.json'
+# HTTP validators and article hash from the last fetch
+FETCH_STATE_FILE = 'data/injuries_fetch.json'
+ARTICLE_PATTERN = re.compile(r'<article\b.*?</article>', re.S | re.I)
 
 class MlsInjuries:
     date_format = '%m/%d/%Y, %H:%M'
@@ -40,16 +46,50 @@ class MlsInjuries:
 
 
 
-def get_injury_content() -> Optional[BeautifulSoup]:
-    for attempt in range(1, 4):
-        try:
-            data = requests.get(INJ_URL, timeout=30)
-            data.encoding = 'utf-8'
-            return BeautifulSoup(data.text, 'html.parser')
-        except requests.RequestException as e:
-            root.warning(f"Attempt {attempt}/3 fetching injury report failed: {e}")
+def load_fetch_state() -> Dict:
+    try:
+        return util.read_json(FETCH_STATE_FILE)
+    except (OSError, ValueError):
+        return {}
+
+
+def article_hash(html: str) -> str:
+    """Hash the article markup only, so page chrome changes are ignored"""
+    articles = ARTICLE_PATTERN.findall(html)
+    content = ''.join(articles) if articles else html
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+async def fetch_injury_html(state: Dict) -> Tuple[Optional[str], Dict]:
+    """Conditionally fetch the injury report.
+
+    Returns ``(html, validators)``; ``html`` is None when the server says
+    the page is unchanged (304) or every attempt failed.
+    """
+    headers = {}
+    if state.get('etag'):
+        headers['If-None-Match'] = state['etag']
+    if state.get('last_modified'):
+        headers['If-Modified-Since'] = state['last_modified']
+    timeout = aiohttp.ClientTimeout(total=30)
+    async with aiohttp.ClientSession(timeout=timeout) as session:
+        for attempt in range(1, 4):
+            try:
+                async with session.get(INJ_URL, headers=headers) as r:
+                    if r.status == 304:
+                        root.info('Injury report not modified since last fetch')
+                        return None, {}
+                    r.raise_for_status()
+                    html = await r.text(encoding='utf-8')
+                    validators = {
+                        'etag': r.headers.get('ETag'),
+                        'last_modified': r.headers.get('Last-Modified')
+                    }
+                    return html, validators
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                root.warning(f"Attempt {attempt}/3 fetching injury report failed: {e}")
     root.error("All 3 attempts to fetch injury report failed")
-    return None
+    return None, {}
 
 
 def populate_injuries(soup: BeautifulSoup) -> MlsInjuries:
@@ -78,34 +118,20 @@ def parse_datetime(soup: BeautifulSoup) -> Optional[datetime]:
         return None
 
 
-def parse_matchday(soup: BeautifulSoup) -> int:
+def parse_matchday(soup: BeautifulSoup) -> Optional[int]:
     pattern = re.compile(r"UPDATED\s+THROUGH:?\s+Matchday\s+(\d+)")
-    matchday_number = None
     found_elements = soup.find_all(string=pattern)
-    if found_elements:
-        print(f"Found {len(found_elements)} matching elements.")
-        first_match_text = found_elements[0].strip()
-        match = pattern.search(first_match_text)
-        if match:
-            try:
-                # group(1) corresponds to the first capturing group (\d+)
-                matchday_number_str = match.group(1)
-                matchday_number = int(matchday_number_str)
-                print(f"Found text: '{first_match_text}'")
-                print(f"Extracted Matchday Number: {matchday_number}")
-            except ValueError:
-                print(f"Found text '{first_match_text}', but could not convert '{matchday_number_str}' to an integer.")
-            except IndexError:
-                print(f"Found text '{first_match_text}', but couldn't extract the number group.")
-        else:
-            print(f"Found element with text '{first_match_text}', but regex couldn't extract number.")
-
-    else:
-        print("No text matching the pattern 'UPDATED THROUGH: Matchday [number]' found.")
-
-    # You can now use the variable 'matchday_number' which holds the integer (or None if not found/extracted)
-    if matchday_number is not None:
-        print(f"\nThe extracted number is: {matchday_number}")
+    if not found_elements:
+        root.debug("No text matching the pattern 'UPDATED THROUGH: Matchday [number]' found.")
+        return None
+    root.debug(f"Found {len(found_elements)} matching elements.")
+    first_match_text = found_elements[0].strip()
+    match = pattern.search(first_match_text)
+    if not match:
+        root.debug(f"Found element with text '{first_match_text}', but regex couldn't extract number.")
+        return None
+    matchday_number = int(match.group(1))
+    root.debug(f"Extracted matchday {matchday_number} from '{first_match_text}'")
     return matchday_number
 
 def parse_injuries(soup: BeautifulSoup) -> Dict:
@@ -136,28 +162,35 @@ def parse_injuries(soup: BeautifulSoup) -> Dict:
 
 def match_teams(injury_obj: Dict) -> Dict:
     """Returns a dict with team opta ID as key, injury list as value"""
-    teams = names.items()
+    resolver = clubs.get_resolver()
     opta_injuries = {}
-
-    for item in injury_obj.items():
-        team = item[0]
-        for t in teams:
-            if team.lower() == t[1][0].lower():
-                opta_injuries[t[0]] = item[1]
-                break
-            if t[1][1].lower() in team.lower():
-                opta_injuries[t[0]] = item[1]
-                break
-    
+    for team, team_injuries in injury_obj.items():
+        opta_id = resolver.opta_id(team) if team else None
+        if opta_id is None:
+            if team:
+                root.warning(f'Could not match injury report team "{team}"')
+            continue
+        opta_injuries[opta_id] = team_injuries
     return opta_injuries
 
 
-def main():
-    retval = False
-    soup = get_injury_content()
-    if soup is None:
-        root.error("Could not fetch injury content, skipping update")
-        return retval
+async def main():
+    """Update the injury file if the report changed since the last run
+
+    Returns True if the injury file was rewritten.
+    """
+    state = load_fetch_state()
+    html, validators = await fetch_injury_html(state)
+    if html is None:
+        return False
+
+    content_hash = article_hash(html)
+    if content_hash == state.get('content_hash'):
+        root.info('Injury report content unchanged, skipping update')
+        util.write_json({**state, **validators}, FETCH_STATE_FILE)
+        return False
+
+    soup = BeautifulSoup(html, util.HTML_PARSER)
     inj_obj = populate_injuries(soup)
     newest_inj = {'matchday': inj_obj.matchday if inj_obj.matchday else "Unknown", 'injuries': {}}
     new_inj = inj_obj.to_dict()
@@ -165,8 +198,11 @@ def main():
         new_key = str(key)
         newest_inj['injuries'][new_key] = new_inj['injuries'][key]
     util.write_json(newest_inj, INJ_FILE)
-    return retval
+    util.write_json({**validators, 'content_hash': content_hash}, FETCH_STATE_FILE)
+    changes = datasets.get_store().record('injuries', newest_inj)
+    root.info(f'Injury report updated: {len(changes.teams) if changes else 0} teams changed')
+    return True
 
 
 if __name__ == '__main__':
-    main()
+    asyncio.run(main())
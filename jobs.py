@@ -0,0 +1,91 @@
+"""
+Thread jobs run by the controller's scheduler.
+
+Each job re-checks whether its work is already done before starting, so a
+job that fires late, twice, or after a restart never double-posts.
+"""
+import logging
+import traceback
+from typing import Awaitable, Callable, List, Set
+
+import discord as msg
+import match_thread as thread
+
+logger = logging.getLogger(__name__)
+
+# sportec IDs of matches whose live thread loop is running in this process
+active_match_threads: Set[str] = set()
+
+# called with the match ID once a match thread has finished (e.g. to refresh widgets)
+after_match: List[Callable[[str], Awaitable[None]]] = []
+
+
+def is_done(kind: str, match_id: str, post: bool = True) -> bool:
+    """Return True if a planned job of ``kind`` has nothing left to do."""
+    threads = thread.file_manager.get_threads(str(match_id))
+    if kind == 'pre':
+        return bool(threads and threads.pre)
+    if kind == 'match':
+        # an existing match thread is resumed until it has made its final
+        # update (teams without post-match threads never get ``post``)
+        return (
+            match_id in active_match_threads
+            or bool(threads and (threads.post or (threads.match and threads.final)))
+        )
+    if kind == 'post':
+        # the post-match check only resumes an orphaned match thread
+        return (
+            not post
+            or match_id in active_match_threads
+            or not (threads and threads.match)
+            or bool(threads.post)
+        )
+    return False
+
+
+async def pre_match_thread_job(match_id: str, subreddit: str):
+    """Post the pre-match thread unless one already exists"""
+    if is_done('pre', match_id):
+        logger.info(f'Pre-match thread for {match_id} already posted, skipping')
+        return
+    await thread.pre_match_thread(match_id, subreddit)
+
+
+async def match_thread_job(match_id: str, subreddit: str, post: bool = True):
+    """Post (or resume) and maintain the match thread"""
+    if match_id in active_match_threads:
+        logger.info(f'Match thread for {match_id} already running, skipping')
+        return
+    message = f'Posting match thread for {match_id} on subreddit {subreddit}'
+    logger.info(message)
+    await msg.async_send(message, tag=True)
+
+    active_match_threads.add(match_id)
+    try:
+        await thread.match_thread(match_id, subreddit, post=post)
+    except Exception as e:
+        logger.error(f"Error creating match thread: {str(e)}\n{traceback.format_exc()}")
+        await msg.async_send(f"Error creating match thread for {match_id}: {str(e)}")
+        return
+    finally:
+        active_match_threads.discard(match_id)
+
+    for callback in after_match:
+        try:
+            await callback(match_id)
+        except Exception as e:
+            logger.error(f"After-match hook {callback.__qualname__} failed for {match_id}: {str(e)}")
+
+
+async def post_match_check_job(match_id: str, subreddit: str, post: bool = True):
+    """Resume a match thread that has no post-match thread yet
+
+    The match thread posts the post-match thread itself once the match is
+    final; this only catches threads orphaned by a restart or crash.
+    """
+    if is_done('post', match_id, post):
+        return
+    message = f'No post-match thread for {match_id}, resuming match thread'
+    logger.info(message)
+    await msg.async_send(message, tag=True)
+    await match_thread_job(match_id, subreddit, post)
@@ -0,0 +1,131 @@
+"""
+Event-loop lag monitor and stall profiler.
+
+A heartbeat callback on the loop measures how late the loop runs it, and
+records every measurement in a lag histogram. A watchdog thread watches
+the heartbeat; when the loop has not run it for longer than ``threshold``
+it captures the loop thread's current stack, i.e. the code that is
+blocking, and appends it to the report file. Optionally asyncio's debug
+mode is switched on so slow callbacks are logged to the same report.
+"""
+import asyncio
+from datetime import datetime
+import logging
+import sys
+import threading
+import time
+import traceback
+from typing import Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+REPORT_FILE = 'log/loop_stalls.log'
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LOOP_LAG = metrics.Histogram('event_loop_lag_seconds', 'Event loop scheduling delay', buckets=LAG_BUCKETS)
+LOOP_STALLS = metrics.Counter('event_loop_stalls_total', 'Loop stalls longer than the monitor threshold')
+SLOW_CALLBACKS = metrics.Counter('event_loop_slow_callbacks_total', 'Callbacks reported slow by asyncio debug mode')
+
+
+class _SlowCallbackHandler(logging.Handler):
+    """Route asyncio's debug-mode slow callback warnings to the report"""
+    def __init__(self, monitor: 'LoopMonitor'):
+        super().__init__(logging.WARNING)
+        self.monitor = monitor
+
+    def emit(self, record: logging.LogRecord) -> None:
+        message = record.getMessage()
+        if message.startswith('Executing') and ' took ' in message:
+            SLOW_CALLBACKS.inc()
+            self.monitor.report(f'slow callback: {message}')
+
+
+class LoopMonitor:
+    def __init__(
+        self,
+        interval: float = 0.25,
+        threshold: float = 0.25,
+        report_path: str = REPORT_FILE,
+        debug: bool = False
+    ):
+        self.interval = interval
+        self.threshold = threshold
+        self.report_path = report_path
+        self.debug = debug
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._handle: Optional[asyncio.TimerHandle] = None
+        self._expected = 0.0
+        # monotonic time of the last heartbeat, read by the watchdog thread
+        self._beat = 0.0
+        self._stall_captured = False
+        self._stop = threading.Event()
+        self._watchdog: Optional[threading.Thread] = None
+        self._handler: Optional[_SlowCallbackHandler] = None
+        self._report_lock = threading.Lock()
+
+    def start(self) -> None:
+        """Start monitoring the running loop."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._schedule()
+        if self.debug:
+            self._loop.set_debug(True)
+            self._loop.slow_callback_duration = self.threshold
+            self._handler = _SlowCallbackHandler(self)
+            logging.getLogger('asyncio').addHandler(self._handler)
+        self._stop.clear()
+        self._watchdog = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._watchdog.start()
+        logger.info(f'Loop monitor started (threshold {self.threshold}s, debug {self.debug})')
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._handle is not None:
+            self._handle.cancel()
+        if self._handler is not None:
+            logging.getLogger('asyncio').removeHandler(self._handler)
+            self._handler = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=self.interval * 4)
+
+    def _schedule(self) -> None:
+        self._expected = self._loop.time() + self.interval
+        self._handle = self._loop.call_at(self._expected, self._heartbeat)
+
+    def _heartbeat(self) -> None:
+        lag = max(0.0, self._loop.time() - self._expected)
+        LOOP_LAG.observe(lag)
+        metrics.LOOP_LAG_SECONDS.set(lag)
+        if self._stall_captured:
+            self.report(f'stall ended after {lag:.3f}s\n')
+            self._stall_captured = False
+        self._beat = time.monotonic()
+        self._schedule()
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.threshold / 2):
+            overdue = time.monotonic() - self._beat - self.interval
+            if overdue > self.threshold and not self._stall_captured:
+                self._stall_captured = True
+                LOOP_STALLS.inc()
+                self.report(f'loop blocked for {overdue:.3f}s so far; loop thread stack:\n{self._loop_stack()}')
+
+    def _loop_stack(self) -> str:
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return '<loop thread not found>'
+        return ''.join(traceback.format_stack(frame))
+
+    def report(self, text: str) -> None:
+        line = f'{datetime.now().isoformat(timespec="milliseconds")} {text}'
+        logger.warning(line.splitlines()[0])
+        try:
+            with self._report_lock, open(self.report_path, 'a') as f:
+                f.write(line if line.endswith('\n') else line + '\n')
+        except OSError as e:
+            logger.error(f'Could not write loop stall report: {e}')
@@ -2,10 +2,12 @@ from collections import defaultdict
 from datetime import datetime
 import json
 import logging
-import os
 import sys
-from typing import Dict, List, Optional
+from typing import Dict, List, Mapping, Optional
 from api_client import MLSApiClient
+import config
+import datasets
+import head_to_head
 from models.club import Club_Sport
 from models.event import EventDetails, MlsEvent, SubstitutionEvent
 from models.match import ComprehensiveMatchData
@@ -13,7 +15,7 @@ from models.person import BasePerson
 from models.schedule import Broadcaster, Competition
 from models.team_stats import TeamStats
 from models.venue import MatchVenue
-import util
+import warehouse
 
 logging.basicConfig(
     level=logging.INFO,  # Set the minimum level of messages to handle (e.g., INFO, DEBUG)
@@ -39,17 +41,14 @@ class Match:
     away_goals: int = 0
     home_starters: List[BasePerson] = None
     away_starters: List[BasePerson] = None
-    injuries: Optional[Dict] = None
-    discipline: Optional[Dict] = None
-    _sportec_to_opta: Dict[str, str] = None
+    # shared read-only views from datasets.get_cache(), keyed by opta ID
+    injuries: Optional[Mapping] = None
+    discipline: Optional[Mapping] = None
+    _h2h_history_indexed: bool = False
+    _h2h_result_indexed: bool = False
 
     def __init__(self, sportec_id: str):
         self.sportec_id = sportec_id
-        self._sportec_to_opta = {
-            entry.sportec_id: str(opta_id)
-            for opta_id, entry in util.names.items()
-            if entry.sportec_id
-        }
     
     async def _fetch_data(self, client: Optional[MLSApiClient] = None) -> ComprehensiveMatchData:
         if client is not None:
@@ -71,12 +70,56 @@ class Match:
         match._process_data(data)
         match.update_injuries()
         match.update_discipline()
+        await match._record_snapshot(data)
+        await match._index_head_to_head(data)
+        return match
+
+    @classmethod
+    def restore(cls, sportec_id: str, ts: Optional[float] = None) -> Optional['Match']:
+        """Rebuild a match from the snapshot warehouse without calling the API.
+
+        Returns None if no snapshot is stored for the match.
+        """
+        data = warehouse.get_warehouse().data_at(sportec_id, ts)
+        if data is None or data.match_info is None:
+            return None
+        match = cls(sportec_id)
+        match.data = data
+        match._process_data(data)
+        match.update_injuries()
+        match.update_discipline()
         return match
 
     async def refresh(self, client: Optional[MLSApiClient] = None):
         data = await self._fetch_data(client)
         self.data = data
         self._process_data(data)
+        await self._record_snapshot(data)
+        await self._index_head_to_head(data)
+
+    async def _record_snapshot(self, data: ComprehensiveMatchData) -> None:
+        """Store this refresh in the snapshot warehouse (delta only)."""
+        if not config.FEATURE_FLAGS.get('enable_match_warehouse', True):
+            return
+        try:
+            await warehouse.get_warehouse().async_record(self.sportec_id, data)
+        except Exception as e:
+            logger.warning(f"Failed to record snapshot for {self.sportec_id}: {e}")
+
+    async def _index_head_to_head(self, data: ComprehensiveMatchData) -> None:
+        """Add previous meetings, and this match once final, to the head-to-head index."""
+        if data.match_base is None:
+            return
+        try:
+            index = head_to_head.get_index()
+            if not self._h2h_history_indexed and data.match_base.last_matches:
+                await index.async_add_matches(data.match_base.last_matches)
+                self._h2h_history_indexed = True
+            if not self._h2h_result_indexed and self.is_final():
+                await index.async_add_finished_match(data.match_base)
+                self._h2h_result_indexed = True
+        except Exception as e:
+            logger.warning(f"Failed to update head-to-head index for {self.sportec_id}: {e}")
     
     def _process_data(self, data: ComprehensiveMatchData) -> None:
         """
@@ -111,25 +154,15 @@ class Match:
         self.away_starters = lineups.get(self.away_id, [])
     
     def update_injuries(self) -> None:
-        inj_file = 'data/injuries.json'
-        if not os.path.exists(inj_file):
-            logger.warning(f"{inj_file} not found, skipping injury data")
-            return
         try:
-            data = util.read_json(inj_file)
-            self.injuries = data.get('injuries', {})
+            self.injuries = datasets.get_cache().injuries()
         except Exception as e:
             logger.warning(f"Failed to read injury data: {e}")
             self.injuries = {}
 
     def update_discipline(self) -> None:
-        disc_file = 'data/discipline.json'
-        if not os.path.exists(disc_file):
-            logger.warning(f"{disc_file} not found, skipping discipline data")
-            return
         try:
-            data = util.read_json(disc_file)
-            self.discipline = data.get('discipline', {})
+            self.discipline = datasets.get_cache().discipline()
         except Exception as e:
             logger.warning(f"Failed to read discipline data: {e}")
             self.discipline = {}
@@ -6,8 +6,11 @@ import sys
 import time
 from typing import Dict, List, Optional
 
+import clubs
 import config
+import head_to_head
 from match import Match
+import util
 from models.event import SubstitutionEvent
 from models.person import BasePerson
 
@@ -93,6 +96,10 @@ def generate_match_footer(match_obj: Match) -> str:
     footer += update + f'. All data via mlssoccer.com. Match ID: {str(match_obj.sportec_id)}'
     return f'^({footer})'
 
+def strip_footer(markdown: str) -> str:
+    """Return thread markdown without the "Last Updated" footer"""
+    return markdown.rsplit('^(Last Updated', 1)[0]
+
 def generate_match_stats(match_obj: Match) -> str:
     if match_obj.competition not in ["Regular Season"]:
         return None
@@ -203,8 +210,38 @@ def generate_broadcasters(match_obj: Match) -> str:
 
     return ", ".join(retval)
 
-def generate_previous_matchups(match_obj: Match) -> Optional[str]:
-    return None
+def generate_previous_matchups(match_obj: Match, limit: int = 5) -> Optional[str]:
+    """Generate the previous matchups section from the local head-to-head index."""
+    try:
+        index = head_to_head.get_index()
+        before = match_obj.get_utc_datetime() if match_obj.data.match_base else None
+        before = before.isoformat() if before else None
+        meetings = index.last_meetings(match_obj.home_id, match_obj.away_id, limit, before=before)
+        record = index.record(match_obj.home_id, match_obj.away_id, before=before)
+    except Exception as e:
+        logger.warning(f"Failed to read head-to-head index: {e}")
+        return None
+    if not meetings:
+        return None
+
+    home_display = match_obj.home.abbreviation or match_obj.home.shortName or match_obj.home.fullName
+    away_display = match_obj.away.abbreviation or match_obj.away.shortName or match_obj.away.fullName
+    lines = ["### Previous Matchups"]
+    if record and record.played:
+        lines.append(
+            f"**{home_display} record vs. {away_display}:** {record.wins}W {record.draws}D {record.losses}L "
+            f"({record.goals_for}-{record.goals_against} GF-GA)"
+        )
+        lines.append("")
+    lines.append("| Date | Home | Score | Away |")
+    lines.append("| :--- | ---: | :---: | :--- |")
+    for m in meetings:
+        try:
+            date = util.normalize_datetime(m.match_date).astimezone().strftime('%b %d, %Y')
+        except ValueError:
+            date = m.match_date
+        lines.append(f"| {date} | {m.home_team_name} | {m.home_goals}-{m.away_goals} | {m.away_team_name} |")
+    return "\n".join(lines)
 
 def generate_injuries(match_obj: Match) -> Optional[str]:
     """Generate injury report section for pre-match threads."""
@@ -213,7 +250,7 @@ def generate_injuries(match_obj: Match) -> Optional[str]:
 
     lines = ["### Injury Report"]
     for team_id, team_name in [(match_obj.home_id, match_obj.home.fullName), (match_obj.away_id, match_obj.away.fullName)]:
-        opta_id = match_obj._sportec_to_opta.get(team_id)
+        opta_id = clubs.get_resolver().sportec_to_opta(team_id)
         if opta_id and opta_id in match_obj.injuries:
             injury_list = match_obj.injuries[opta_id]
             if injury_list:
@@ -228,13 +265,13 @@ def generate_discipline(match_obj: Match) -> Optional[str]:
 
     lines = ["### Discipline"]
     for team_id, team_name in [(match_obj.home_id, match_obj.home.fullName), (match_obj.away_id, match_obj.away.fullName)]:
-        opta_id = match_obj._sportec_to_opta.get(team_id)
+        opta_id = clubs.get_resolver().sportec_to_opta(team_id)
         if opta_id and opta_id in match_obj.discipline:
             team_disc = match_obj.discipline[opta_id]
             if team_disc:
                 parts = []
                 for reason, players in team_disc.items():
-                    if isinstance(players, list):
+                    if isinstance(players, (list, tuple)):
                         parts.append(f"{reason}: {', '.join(players)}")
                     else:
                         parts.append(f"{reason}: {players}")
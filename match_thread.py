@@ -10,10 +10,12 @@ import config
 import match_markdown as md
 from api_client import MLSApiClient
 from match import Match
+import metrics
 from thread_manager import MatchThreads, ThreadManager
 import util
 import discord as msg
-from reddit_client import RedditClient
+from reddit_client import RedditClient, client_session
+from reddit_quota import Priority
 
 logger = logging.getLogger(__name__)
 
@@ -27,13 +29,16 @@ parser.add_argument('-s', '--sub', help='Subreddit')
 test_sub = config.TEST_SUB
 prod_sub = config.SUB
 file_manager = ThreadManager(config.THREADS_JSON)
+# edit at least this often (seconds) so the "Last Updated" footer stays current
+FOOTER_REFRESH = 600
 
-async def pre_match_thread(sportec_id: str, sub: str = prod_sub):
+async def pre_match_thread(sportec_id: str, sub: str = prod_sub, reddit: Optional[RedditClient] = None):
     """Post a pre-match/matchday thread.
     
     Args:
         sportec_id: Sportec ID for the match
         sub: Subreddit to post to
+        reddit: Client to use (default: the shared client)
         
     Returns:
         The created pre-match thread
@@ -46,7 +51,7 @@ async def pre_match_thread(sportec_id: str, sub: str = prod_sub):
     # get post details for the match object
     title, markdown = md.pre_match_thread(match_obj)
     
-    async with RedditClient() as reddit:
+    async with client_session(reddit) as reddit:
         thread: asyncpraw.models.Submission = await reddit.submit_thread(sub, title, markdown, new=True, mod=True)
         await msg.async_send(f'Pre-match thread posted! https://www.reddit.com/r/{sub}/comments/{thread.id_from_url(thread.shortlink)}', tag=True)
     
@@ -66,7 +71,8 @@ async def match_thread(
     sub: str = prod_sub,
     pre_thread: Optional[Union[str, asyncpraw.models.Submission]] = None,
     thread: Optional[Union[str, asyncpraw.models.Submission]] = None,
-    post: bool = True
+    post: bool = True,
+    reddit: Optional[RedditClient] = None
 ) -> None:
     """Post and maintain a match thread.
     
@@ -76,6 +82,7 @@ async def match_thread(
         pre_thread: Pre-match thread to unsticky
         thread: Existing match thread to update
         post: Whether to create a post-match thread when done
+        reddit: Client to use (default: the shared client)
     """
     async with MLSApiClient() as api_client:
         # get a match object
@@ -95,79 +102,128 @@ async def match_thread(
         if threads.post:
             post_thread = threads.post
 
-        async with RedditClient() as reddit:
+        async with client_session(reddit) as reddit:
+            setup: Optional[asyncio.Task] = None
             if thread is None:
                 title, markdown = md.match_thread(match_obj)
                 if '/r/' in sub:
                     sub = sub.split('/r/')[1]
-                thread = await reddit.submit_thread(
-                    sub, title, markdown,
-                    mod=True, new=True, unsticky=pre_thread
+                thread = await reddit.submit_thread(sub, title, markdown)
+                # the live loop starts right away; everything else that only
+                # needs the new thread's ID runs alongside it
+                setup = asyncio.create_task(
+                    _after_submit(reddit, sportec_id, sub, threads, thread, pre_thread, post)
                 )
-
-                threads.match = thread.id_from_url(thread.shortlink)
-                await file_manager.add_threads(sportec_id, threads)
-
-                if pre_thread is not None:
-                    text = f'[Continue the discussion in the match thread.](https://www.reddit.com/r/{sub}/comments/{thread.id_from_url(thread.shortlink)})'
-                    await reddit.add_comment(pre_thread, text)
-                await msg.async_send(f'Match thread posted! https://www.reddit.com/r/{sub}/comments/{thread.id_from_url(thread.shortlink)}', tag=True)
-
-                if not post:
-                    await msg.async_send(f'No post-match thread for {thread.id_from_url(thread.shortlink)}')
             else:
                 # thread already exists in the json
                 thread = await reddit.get_thread(thread)
                 await thread.load()
                 await msg.async_send(f'Found existing match thread')
 
-            while True:
-                before = time.time()
-                try:
-                    await match_obj.refresh(client=api_client)
-                    after = time.time()
-                    logger.info(f'Match update took {round(after-before, 2)} secs')
-                    _, markdown = md.match_thread(match_obj)
+            try:
+                last_body = None
+                last_edit = 0.0
+                last_score = (match_obj.home_goals, match_obj.away_goals)
+                while True:
+                    before = time.time()
                     try:
-                        await reddit.edit_thread(thread, markdown)
-                        logger.debug(f'Successfully updated {match_obj.sportec_id} at minute {match_obj.minute_display}')
+                        with metrics.MATCH_REFRESH_SECONDS.time():
+                            await match_obj.refresh(client=api_client)
+                        after = time.time()
+                        logger.info(f'Match update took {round(after-before, 2)} secs')
+                        with metrics.RENDER_SECONDS.time(thread='match'):
+                            _, markdown = md.match_thread(match_obj)
+                        body = md.strip_footer(markdown)
+                        if body == last_body and after - last_edit < FOOTER_REFRESH:
+                            # only the "Last Updated" footer changed
+                            metrics.THREAD_EDITS.inc(result='skipped')
+                            logger.debug(f'No changes for {match_obj.sportec_id}, skipping edit')
+                        else:
+                            score = (match_obj.home_goals, match_obj.away_goals)
+                            # goal edits jump the queue when quota runs short
+                            priority = Priority.GOAL_EDIT if score != last_score else Priority.EDIT
+                            try:
+                                await reddit.edit_thread(thread, markdown, priority=priority)
+                                last_body, last_edit, last_score = body, after, score
+                                metrics.THREAD_EDITS.inc(result='edited')
+                                logger.debug(f'Successfully updated {match_obj.sportec_id} at minute {match_obj.minute_display}')
+                            except Exception as e:
+                                metrics.THREAD_EDITS.inc(result='failed')
+                                message = (
+                                    f'Error while editing match thread.\n'
+                                    f'{str(e)}\n'
+                                    f'Continuing while loop.'
+                                )
+                                logger.error(message)
+                                await msg.async_send(message, tag=True)
+
                     except Exception as e:
                         message = (
-                            f'Error while editing match thread.\n'
+                            f'Error while getting match update.\n'
                             f'{str(e)}\n'
                             f'Continuing while loop.'
                         )
                         logger.error(message)
                         await msg.async_send(message, tag=True)
 
-                except Exception as e:
-                    message = (
-                        f'Error while getting match update.\n'
-                        f'{str(e)}\n'
-                        f'Continuing while loop.'
-                    )
-                    logger.error(message)
-                    await msg.async_send(message, tag=True)
-
-                if match_obj.is_final():
-                    await msg.async_send('Match is finished, final update made', tag=True)
-                    if post and not post_thread:
-                        # post a post-match thread before exiting the loop
-                        await post_match_thread(sportec_id, sub, thread)
-                    elif not post:
-                        message = f'No post-match thread for {sportec_id}'
-                        await msg.async_send(message)
-                    elif post_thread:
-                        message = f'Found post-match thread for {sportec_id}. Skipping post-match thread.'
-                        await msg.async_send(message, tag=True)
-                    break
-                await asyncio.sleep(60)
+                    if match_obj.is_final():
+                        if setup is not None:
+                            # the post-match thread needs the match thread saved and stickied
+                            await setup
+                            setup = None
+                        await file_manager.update_thread(sportec_id, final=True)
+                        await msg.async_send('Match is finished, final update made', tag=True)
+                        if post and not post_thread:
+                            # post a post-match thread before exiting the loop
+                            await post_match_thread(sportec_id, sub, thread, reddit=reddit)
+                        elif not post:
+                            message = f'No post-match thread for {sportec_id}'
+                            await msg.async_send(message)
+                        elif post_thread:
+                            message = f'Found post-match thread for {sportec_id}. Skipping post-match thread.'
+                            await msg.async_send(message, tag=True)
+                        break
+                    await asyncio.sleep(60)
+            finally:
+                if setup is not None:
+                    await setup
+
+
+async def _after_submit(
+    reddit: RedditClient,
+    sportec_id: str,
+    sub: str,
+    threads: MatchThreads,
+    thread: asyncpraw.models.Submission,
+    pre_thread: Optional[Union[str, asyncpraw.models.Submission]],
+    post: bool
+) -> None:
+    """Moderate, record and announce a new match thread, concurrently"""
+    thread_id = thread.id_from_url(thread.shortlink)
+    url = f'https://www.reddit.com/r/{sub}/comments/{thread_id}'
+    threads.match = thread_id
+    steps = {
+        'moderation': reddit.moderate_new_thread(thread, new=True, unsticky=pre_thread),
+        'save': file_manager.add_threads(sportec_id, threads),
+        'notification': msg.async_send(f'Match thread posted! {url}', tag=True),
+    }
+    if pre_thread is not None:
+        steps['pre-match comment'] = reddit.add_comment(pre_thread, f'[Continue the discussion in the match thread.]({url})')
+    if not post:
+        steps['no post-match notice'] = msg.async_send(f'No post-match thread for {thread_id}')
+    results = await asyncio.gather(*steps.values(), return_exceptions=True)
+    for step, result in zip(steps, results):
+        if isinstance(result, Exception):
+            message = f'Match thread {thread_id}: {step} failed: {result}'
+            logger.error(message)
+            await msg.async_send(message, tag=True)
 
 
 async def post_match_thread(
     sportec_id: str,
     sub: str = prod_sub,
-    thread: Optional[Union[str, asyncpraw.models.Submission]] = None
+    thread: Optional[Union[str, asyncpraw.models.Submission]] = None,
+    reddit: Optional[RedditClient] = None
 ) -> None:
     """Post a post-match thread.
     
@@ -175,6 +231,7 @@ async def post_match_thread(
         sportec_id: Sportec ID for the match  
         sub: Subreddit to post to
         thread: Match thread to unsticky
+        reddit: Client to use (default: the shared client)
     """
     # get reddit ids of any threads that may already exist for this match
     threads = file_manager.get_threads(sportec_id)
@@ -186,7 +243,7 @@ async def post_match_thread(
 
     match_obj = await Match.create(sportec_id)
     title, markdown = md.post_match_thread(match_obj)
-    async with RedditClient() as reddit:
+    async with client_session(reddit) as reddit:
         post_thread_obj: asyncpraw.models.Submission = await reddit.submit_thread(
             sub, title, markdown,
             mod=True, unsticky=thread
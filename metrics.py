@@ -0,0 +1,224 @@
+"""
+In-process Prometheus metrics and the controller's HTTP endpoint.
+
+Counters, gauges and histograms are kept in a module-level registry and
+rendered in the Prometheus text exposition format at ``/metrics``. All
+metric updates are thread-safe, so worker threads may record too.
+"""
+from bisect import bisect_left
+from contextlib import contextmanager
+import logging
+import re
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_ID_PATTERN = re.compile(r'MLS-[A-Z]{3}-\w+|\b\d{2,}\b')
+
+
+def route(path: str) -> str:
+    """Collapse IDs in a URL path so it can be used as a metric label."""
+    return _ID_PATTERN.sub(':id', path)
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: Dict[str, '_Metric'] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: '_Metric') -> None:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f'Metric {metric.name} already registered')
+            self._metrics[metric.name] = metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines: List[str] = []
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), registry: Registry = REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labels)
+        self._values: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        registry.register(self)
+
+    def _key(self, labels: Dict[str, object]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...], extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.labelnames, key))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ''
+        return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            yield f'{self.name}{self._labels(key)} {_format_value(value)}'
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels) -> None:
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0)
+
+
+class _HistogramValue:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self, buckets: int):
+        self.counts = [0] * buckets
+        self.sum = 0.0
+        self.count = 0
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, registry: Registry = REGISTRY):
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        super().__init__(name, help, labels, registry)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = _HistogramValue(len(self.buckets))
+            entry.counts[i] += 1
+            entry.sum += value
+            entry.count += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the ``with`` block, even if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            items = [(key, list(v.counts), v.sum, v.count) for key, v in self._values.items()]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield f'{self.name}_bucket{self._labels(key, ("le", _format_value(bound)))} {cumulative}'
+            yield f'{self.name}_sum{self._labels(key)} {_format_value(total)}'
+            yield f'{self.name}_count{self._labels(key)} {count}'
+
+
+# MLS APIs
+API_REQUEST_SECONDS = Histogram('mls_api_request_seconds', 'MLS API request latency', ['endpoint', 'route'])
+API_RESPONSES = Counter('mls_api_responses_total', 'MLS API responses by status', ['endpoint', 'status'])
+
+# Reddit
+REDDIT_CALL_SECONDS = Histogram('reddit_call_seconds', 'Reddit API call latency, including retries', ['operation'])
+REDDIT_RETRIES = Counter('reddit_retries_total', 'Reddit API calls retried after a server error', ['operation'])
+REDDIT_FAILURES = Counter('reddit_failures_total', 'Reddit API calls that failed', ['operation'])
+REDDIT_QUOTA_REMAINING = Gauge('reddit_quota_remaining', 'Requests left in the current Reddit rate-limit window')
+REDDIT_QUOTA_USED = Gauge('reddit_quota_used', 'Requests used in the current Reddit rate-limit window')
+REDDIT_QUOTA_RESET_SECONDS = Gauge('reddit_quota_reset_seconds', 'Seconds until the Reddit rate-limit window resets, as of the last response')
+REDDIT_QUEUED = Gauge('reddit_queued_calls', 'Reddit calls waiting for quota', ['priority'])
+REDDIT_QUEUE_WAIT_SECONDS = Histogram('reddit_queue_wait_seconds', 'Time Reddit calls waited for quota', ['priority'])
+REDDIT_RATE_LIMITED = Counter('reddit_rate_limited_total', 'Reddit calls rejected with 429 Too Many Requests', ['operation'])
+
+# match threads
+MATCH_REFRESH_SECONDS = Histogram('match_refresh_seconds', 'Match.refresh duration')
+RENDER_SECONDS = Histogram('markdown_render_seconds', 'Thread markdown render duration', ['thread'])
+THREAD_EDITS = Counter('thread_edits_total', 'Match thread edits by result (edited, skipped, failed)', ['result'])
+
+# scheduler
+SCHEDULER_JOBS = Counter('scheduler_jobs_total', 'Scheduler job outcomes', ['job', 'outcome'])
+
+# event loop
+LOOP_LAG_SECONDS = Gauge('event_loop_last_lag_seconds', 'Most recent event loop scheduling delay')
+
+
+async def _metrics(request: web.Request) -> web.Response:
+    return web.Response(text=REGISTRY.render(), content_type='text/plain', charset='utf-8',
+                        headers={'X-Content-Type-Options': 'nosniff'})
+
+
+async def _health(request: web.Request) -> web.Response:
+    return web.Response(text='ok')
+
+
+async def start_server(host: str = '0.0.0.0', port: int = 9108) -> web.AppRunner:
+    """Serve ``/metrics`` and ``/healthz`` on the running loop."""
+    app = web.Application()
+    app.router.add_get('/metrics', _metrics)
+    app.router.add_get('/healthz', _health)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    logger.info(f'Serving metrics on {host}:{port}')
+    return runner
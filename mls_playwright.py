@@ -1,54 +1,151 @@
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 import logging
-from PIL import Image
+import os
+import re
+from typing import AsyncIterator, Optional
+from urllib.parse import urlsplit
 import asyncio
-from playwright.async_api import async_playwright, Browser, Page
+from playwright.async_api import async_playwright, Browser, BrowserContext, Page, Playwright, Route
+from playwright.async_api import TimeoutError as PlaywrightTimeoutError
+from config import FEATURE_FLAGS
 import discord as msg
+import image_pipeline
 
 logger = logging.getLogger(__name__)
 
 standings_url = 'https://www.mlssoccer.com/standings/#season=MLS-SEA-0001K9&live=false'
 schedule_url = 'https://www.mlssoccer.com/schedule/scores#competition=all&club=MLS-CLU-00001L&date='
 schedule_no_matches = 'mls-c-schedule__no-results-text'
+standings_selector = 'div.mls-c-standings__wrapper'
+schedule_selector = 'div.mls-c-schedule__matches'
 
-async def setup_browser():
-    """Initialize and return a Playwright browser instance with proper configuration"""
-    playwright = await async_playwright().start()
-    browser = await playwright.chromium.launch(
-        headless=True,
-        args=['--no-sandbox', '--disable-dev-shm-usage']
-    )
-    return browser, playwright
-
-async def get_page(browser: Browser, url: str, width=375, height=2800) -> Page:
-    """Create and configure a new page with the given dimensions"""
-    page = await browser.new_page()
-    await page.set_viewport_size({"width": width, "height": height})
-    await page.goto(url)
-    
-    # Handle cookie banner
-    try:
-        accept_button = page.locator('button#onetrust-accept-btn-handler')
-        await accept_button.click()
-    except Exception as e:
-        logger.debug(f"Cookie banner handling error: {e}")
-    
-    try:
-        # 'networkidle' waits until there are no network connections for 500 ms.
-        logger.debug("Waiting for network idle...")
-        await page.wait_for_load_state('networkidle', timeout=10000)
-        logger.debug("Network is idle.")
-    except Exception as e:
-        logger.warning(f"Timeout or error waiting for network idle: {e}")
-        # Decide if you want to proceed anyway or raise the error
+# cookies and local storage with the OneTrust consent already given
+STORAGE_STATE = 'data/playwright_state.json'
+CONSENT_BUTTON = 'button#onetrust-accept-btn-handler'
+# ms to wait for the element we screenshot
+READY_TIMEOUT = 20000
+
+# hosts (and their subdomains) pages may load from; OneTrust stays so consent works
+FIRST_PARTY = ('mlssoccer.com', 'cookielaw.org', 'onetrust.com')
+BLOCKED_TYPES = ('media', 'websocket', 'eventsource', 'manifest')
+TRACKING = re.compile(
+    r'analytics|doubleclick|googletag|gtm\.js|adsystem|adservice|amazon-adsystem|'
+    r'facebook|scorecardresearch|newrelic|nr-data|segment\.(io|com)|hotjar|'
+    r'optimizely|taboola|outbrain|chartbeat|quantserve|pixel|beacon|tiktok',
+    re.IGNORECASE
+)
+
+
+def _first_party(host: str, allowed) -> bool:
+    return any(host == domain or host.endswith('.' + domain) for domain in allowed)
+
+
+def should_block(url: str, resource_type: str, allowed=FIRST_PARTY) -> bool:
+    """True for third-party, media and tracking requests"""
+    if resource_type in BLOCKED_TYPES:
+        return True
+    if not url.startswith(('http://', 'https://')):
+        return False
+    if not _first_party(urlsplit(url).hostname or '', allowed):
+        return True
+    return bool(TRACKING.search(url))
+
+
+class BrowserPool:
+    """One Chromium process per job run, handing out pages in isolated contexts
+
+    At most ``max_pages`` pages are open at once; further requests wait.
+    Every context starts from the saved storage state, so the cookie banner
+    is only accepted once, and (unless disabled by the
+    ``playwright_block_requests`` flag) aborts requests ``should_block``
+    rejects.
+    """
+    def __init__(self, max_pages: int = 3, storage_state: str = STORAGE_STATE):
+        self.max_pages = max_pages
+        self.storage_state = storage_state
+        self.block_requests = FEATURE_FLAGS.get('playwright_block_requests', True)
+        self.allowed = tuple(FEATURE_FLAGS.get('playwright_allowed_domains', FIRST_PARTY))
+        self._pages = asyncio.Semaphore(max_pages)
+        self._consent = asyncio.Lock()
+        self._has_consent = False
+        self._playwright: Optional[Playwright] = None
+        self._browser: Optional[Browser] = None
+
+    async def start(self) -> 'BrowserPool':
+        self._playwright = await async_playwright().start()
+        self._browser = await self._playwright.chromium.launch(
+            headless=True,
+            args=['--no-sandbox', '--disable-dev-shm-usage']
+        )
+        self._has_consent = os.path.exists(self.storage_state)
+        logger.debug(f'Launched Chromium (max {self.max_pages} pages, consent stored: {self._has_consent})')
+        return self
+
+    async def close(self) -> None:
+        if self._browser is not None:
+            await self._browser.close()
+            self._browser = None
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+    async def __aenter__(self) -> 'BrowserPool':
+        return await self.start()
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def _route(self, route: Route) -> None:
+        request = route.request
+        if should_block(request.url, request.resource_type, self.allowed):
+            await route.abort()
+        else:
+            await route.continue_()
 
-    return page
+    async def _new_context(self, width: int, height: int, consented: bool) -> BrowserContext:
+        state = self.storage_state if consented else None
+        context = await self._browser.new_context(viewport={"width": width, "height": height}, storage_state=state)
+        if self.block_requests:
+            await context.route('**/*', self._route)
+        return context
 
-async def get_screenshot(url: str, outer_selector: str, inner_selector: str = None, title: str = None) -> str:
+    async def _accept_cookies(self, context: BrowserContext, page: Page) -> None:
+        """Click the consent banner and save the resulting storage state once"""
+        try:
+            await page.locator(CONSENT_BUTTON).click(timeout=5000)
+        except Exception as e:
+            logger.debug(f"Cookie banner handling error: {e}")
+            return
+        async with self._consent:
+            if self._has_consent:
+                return
+            await context.storage_state(path=self.storage_state)
+            self._has_consent = True
+        logger.info(f'Saved cookie consent to {self.storage_state}')
+
+    @asynccontextmanager
+    async def page(self, url: str, ready_selector: str, width=375, height=2800) -> AsyncIterator[Page]:
+        """Open ``url`` in a fresh context once ``ready_selector`` is visible.
+
+        The context is closed on exit.
+        """
+        async with self._pages:
+            consented = self._has_consent
+            context = await self._new_context(width, height, consented)
+            try:
+                page = await context.new_page()
+                await page.goto(url, wait_until='domcontentloaded')
+                if not consented:
+                    await self._accept_cookies(context, page)
+                await page.wait_for_selector(ready_selector, state='visible', timeout=READY_TIMEOUT)
+                yield page
+            finally:
+                await context.close()
+
+async def get_screenshot(pool: BrowserPool, url: str, outer_selector: str, inner_selector: str = None, title: str = None) -> str:
     """Take a screenshot of specified elements on the page"""
-    browser, playwright = await setup_browser()
-    try:
-        page = await get_page(browser, url)
+    async with pool.page(url, outer_selector) as page:
         elements = await page.query_selector_all(outer_selector)
         logger.debug(f'Found {len(elements)} elements')
         
@@ -63,70 +160,66 @@ async def get_screenshot(url: str, outer_selector: str, inner_selector: str = No
             filename = write_screenshot(screenshot, title)
             
         return filename
-    finally:
-        await browser.close()
-        await playwright.stop()
 
-async def get_standings():
+async def get_standings(pool: BrowserPool):
     """Get standings screenshot"""
     return await get_screenshot(
+        pool,
         standings_url,
-        'div.mls-c-standings__wrapper',
+        standings_selector,
         'tr.mls-o-table__header-group.mls-o-table__header-group--main'
     )
 
-async def schedule_controller():
-    """Get schedule screenshots for current and next week"""
-    shots = 0
-    tries = 0
-    date = datetime.now()
-    browser, playwright = await setup_browser()
-    
+async def get_week(pool: BrowserPool, date: datetime) -> Optional[bytes]:
+    """Screenshot the schedule for the week of ``date``, or None if it has no matches
+
+    A week that does not load in time is skipped rather than failing the
+    other weeks loaded alongside it.
+    """
+    dated_url = f'{schedule_url}{date.year}-{date.month}-{date.day}'
+    logger.debug(f'Checking {dated_url}')
     try:
-        while (shots < 2 and tries < 4) and date.year == datetime.now().year:
-            dated_url = f'{schedule_url}{date.year}-{date.month}-{date.day}'
-            logger.debug(f'Checking {dated_url}')
-            
-            page = await get_page(browser, dated_url)
-            
+        async with pool.page(dated_url, f'{schedule_selector}, .{schedule_no_matches}') as page:
             no_matches = await page.query_selector(f'.{schedule_no_matches}')
             if no_matches:
                 msg.send(f'No matches for {dated_url}')
-            else:
-                title = 'This Week' if shots == 0 else 'Next Week'
-                matches = await page.query_selector('div.mls-c-schedule__matches')
-                if matches:
-                    screenshot = await matches.screenshot()
-                    file = write_screenshot(screenshot, title)
-                    pad_image(file)
-                    shots += 1
-            
-            date += timedelta(days=7)
-            tries += 1
-            
-    finally:
-        await browser.close()
-        await playwright.stop()
+                return None
+            matches = await page.query_selector(schedule_selector)
+            if matches:
+                return await matches.screenshot()
+            return None
+    except PlaywrightTimeoutError as e:
+        logger.warning(f'Timed out loading {dated_url}, skipping: {str(e)}')
+        return None
+
+async def schedule_controller(pool: BrowserPool):
+    """Get schedule screenshots for current and next week
 
-def write_screenshot(data: bytes, filename: str) -> str:
-    """Write screenshot data to a file"""
+    Up to four weeks are loaded in parallel; the first two with matches
+    are kept.
+    """
     now = datetime.now()
-    filename = f'png/{filename}-{now.month}-{now.day}.png'
-    with open(filename, 'wb') as f:
-        f.write(data)
-    return filename
-
-def pad_image(filename: str):
-    """Add padding to an image"""
-    im = Image.open(filename)
-    size = im.size
-    padded = Image.new('RGB', (size[0]+10, size[1]+10), (255,255,255))
-    padded.paste(im, (5,5))
-    padded.save(filename)
+    dates = [now + timedelta(days=7 * week) for week in range(4)]
+    dates = [date for date in dates if date.year == now.year]
+    screenshots = await asyncio.gather(*(get_week(pool, date) for date in dates))
 
-async def main():
+    shots = 0
+    for screenshot in screenshots:
+        if screenshot is None:
+            continue
+        title = 'This Week' if shots == 0 else 'Next Week'
+        write_screenshot(screenshot, title, padding=image_pipeline.PADDING)
+        shots += 1
+        if shots == 2:
+            break
+
+def write_screenshot(data: bytes, filename: str, padding: int = 0) -> str:
+    """Process screenshot data in memory and write it to png/"""
+    return image_pipeline.save(filename, image_pipeline.process(data, padding))
+
+async def _standings(pool: BrowserPool):
     try:
-        await get_standings()
+        await get_standings(pool)
         message = "Successfully got standings via Playwright."
         logger.info(message)
         msg.send(message)
@@ -135,8 +228,9 @@ async def main():
         logger.error(message)
         msg.send(message)
 
+async def _schedule(pool: BrowserPool):
     try:
-        await schedule_controller()
+        await schedule_controller(pool)
         message = "Successfully got schedule via Playwright."
         logger.info(message)
         msg.send(message)
@@ -145,5 +239,9 @@ async def main():
         logger.error(message)
         msg.send(message)
 
+async def main():
+    async with BrowserPool() as pool:
+        await asyncio.gather(_standings(pool), _schedule(pool))
+
 if __name__ == '__main__':
     asyncio.run(main())
\ No newline at end of file
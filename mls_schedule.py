@@ -1,16 +1,28 @@
+from datetime import datetime, timezone
 import time
-from typing import List
+from typing import List, Optional, Union
 
 from models.schedule import MatchSchedule
+from schedule_index import ScheduleIndex
 
 
-def check_pre_match_sched(data: List[MatchSchedule], date_from=None):
-    """If there is a match within 48 hours from date_from, return its sportec ID and time."""
+def check_pre_match_sched(data: Union[List[MatchSchedule], ScheduleIndex], date_from=None, team_id: Optional[str] = None):
+    """If there is a match within 48 hours from date_from, return its sportec ID and time.
+
+    ``data`` is either a schedule list or a ScheduleIndex; with an index the
+    window is found by bisection, optionally restricted to ``team_id``.
+    """
     if date_from is None:
         date_from = int(time.time())
     # until +48h
     date_to = date_from + (86400 * 2)
+    if isinstance(data, ScheduleIndex):
+        start = datetime.fromtimestamp(date_from, tz=timezone.utc)
+        end = datetime.fromtimestamp(date_to, tz=timezone.utc)
+        data = data.range(start, end, team_id)
     for match in data:
+        if match.planned_kickoff_time is None:
+            continue
         match_time = match.planned_kickoff_time.timestamp()
         if match_time > date_from and match_time < date_to:
             return match.match_id, match.planned_kickoff_time
@@ -0,0 +1,224 @@
+"""
+Season-horizon job planner.
+
+Plans pre-match, match and post-match check jobs for every remaining match
+of the tracked teams from the schedule index, and reconciles them with the
+scheduler: only jobs whose run time changed are rescheduled, and jobs for
+matches that were cancelled or dropped from the schedule are removed.
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+import logging
+from typing import Callable, Dict, Iterable, List, Optional
+
+from apscheduler.schedulers.base import BaseScheduler
+
+import jobs
+from models.schedule import MatchSchedule
+from schedule_index import ScheduleIndex
+from util import names
+
+logger = logging.getLogger(__name__)
+
+# teams that get a match thread only, no pre- or post-match threads
+MATCH_THREAD_ONLY = {19202}
+
+MATCH_THREAD_LEAD = timedelta(minutes=30)
+POST_CHECK_DELAY = timedelta(hours=3)
+PRE_MATCH_HOUR = 4
+
+# how long after its planned time a missed job is still worth running;
+# a pre-match thread is worth posting until the match thread takes over,
+# so its window is worked out per match in ``plan_match``
+CATCH_UP = {
+    'match': POST_CHECK_DELAY,
+    'post': timedelta(hours=9),
+}
+
+# reschedule only when the planned time moved by more than this
+TOLERANCE = timedelta(minutes=1)
+
+# far enough ahead to cover the rest of any season
+SEASON_HORIZON = timedelta(days=366)
+
+INACTIVE_STATUSES = {'postponed', 'cancelled', 'canceled', 'abandoned'}
+
+JOB_FUNCS: Dict[str, Callable] = {
+    'pre': jobs.pre_match_thread_job,
+    'match': jobs.match_thread_job,
+    'post': jobs.post_match_check_job,
+}
+
+JOB_PREFIXES = {
+    'pre': 'pre_match_thread_',
+    'match': 'match_thread_',
+    'post': 'post_match_check_',
+}
+
+
+@dataclass(order=True)
+class PlannedJob:
+    """A thread job planned for one match"""
+    run_date: datetime
+    kind: str
+    match_id: str
+    team: int = field(compare=False)
+    kickoff: datetime = field(compare=False)
+    post: bool = field(default=True, compare=False)
+    catch_up: timedelta = field(default=timedelta(0), compare=False)
+
+    @property
+    def job_id(self) -> str:
+        return f'{JOB_PREFIXES[self.kind]}{self.match_id}'
+
+    def args(self, subreddit: str) -> list:
+        if self.kind == 'pre':
+            return [self.match_id, subreddit]
+        return [self.match_id, subreddit, self.post]
+
+    def __str__(self) -> str:
+        return f'{self.run_date.strftime("%a %m/%d %H:%M")} {self.kind} {self.match_id} (team {self.team})'
+
+
+@dataclass
+class PlanChanges:
+    """Jobs touched by one reconciliation"""
+    added: List[PlannedJob] = field(default_factory=list)
+    rescheduled: List[PlannedJob] = field(default_factory=list)
+    removed: List[str] = field(default_factory=list)
+
+    def __bool__(self) -> bool:
+        return bool(self.added or self.rescheduled or self.removed)
+
+    def __str__(self) -> str:
+        return f'{len(self.added)} added, {len(self.rescheduled)} rescheduled, {len(self.removed)} removed'
+
+
+def _owned(job_id: str) -> bool:
+    return job_id.startswith(tuple(JOB_PREFIXES.values()))
+
+
+class SeasonPlanner:
+    def __init__(
+        self,
+        scheduler: BaseScheduler,
+        index: ScheduleIndex,
+        subreddit: str,
+        teams: Iterable[int],
+        jobstore: str = 'default'
+    ):
+        self.scheduler = scheduler
+        self.jobstore = jobstore
+        self.index = index
+        self.subreddit = subreddit
+        self.teams = list(teams)
+        self._plan: Dict[str, PlannedJob] = {}
+
+    def plan_match(self, match: MatchSchedule, team: int) -> List[PlannedJob]:
+        """Return the thread jobs for one match, in run order."""
+        kickoff = match.planned_kickoff_time.astimezone()
+        extras = team not in MATCH_THREAD_ONLY
+        match_time = kickoff - MATCH_THREAD_LEAD
+        planned = []
+        if extras:
+            pre_time = min(kickoff.replace(hour=PRE_MATCH_HOUR, minute=0, second=0, microsecond=0), match_time)
+            planned.append(PlannedJob(
+                pre_time, 'pre', match.match_id, team, kickoff, catch_up=max(match_time - pre_time, TOLERANCE)
+            ))
+        planned.append(PlannedJob(
+            match_time, 'match', match.match_id, team, kickoff, extras, catch_up=CATCH_UP['match']
+        ))
+        if extras:
+            planned.append(PlannedJob(
+                kickoff + POST_CHECK_DELAY, 'post', match.match_id, team, kickoff, catch_up=CATCH_UP['post']
+            ))
+        return planned
+
+    def desired(self, now: Optional[datetime] = None) -> Dict[str, PlannedJob]:
+        """Plan every remaining job of the season for the tracked teams.
+
+        Jobs whose time has passed are kept, due immediately, only while
+        they are within their catch-up window and still have work to do.
+        """
+        now = now or datetime.now().astimezone()
+        horizon_start = now - max(CATCH_UP.values()) - POST_CHECK_DELAY
+        horizon_end = now + SEASON_HORIZON
+        plan: Dict[str, PlannedJob] = {}
+        for team in self.teams:
+            team_id = names[team].sportec_id
+            for match in self.index.range(horizon_start, horizon_end, team_id):
+                if match.match_status.lower() in INACTIVE_STATUSES:
+                    continue
+                for job in self.plan_match(match, team):
+                    if job.run_date <= now:
+                        if now - job.run_date > job.catch_up:
+                            continue
+                        if jobs.is_done(job.kind, job.match_id, job.post):
+                            continue
+                        job.run_date = now
+                    plan.setdefault(job.job_id, job)
+        return plan
+
+    @staticmethod
+    def _run_date(planned: PlannedJob, now: datetime) -> Optional[datetime]:
+        # None lets the date trigger fire as soon as the job is added
+        return planned.run_date if planned.run_date > now else None
+
+    def reconcile(self, now: Optional[datetime] = None) -> PlanChanges:
+        """Bring the scheduler's thread jobs in line with the schedule."""
+        now = now or datetime.now().astimezone()
+        desired = self.desired(now)
+        changes = PlanChanges()
+
+        for job in self.scheduler.get_jobs(jobstore=self.jobstore):
+            if not _owned(job.id):
+                continue
+            planned = desired.get(job.id)
+            if planned is None:
+                self.scheduler.remove_job(job.id, jobstore=self.jobstore)
+                changes.removed.append(job.id)
+                continue
+            next_run = getattr(job, 'next_run_time', None)
+            # a job already due stays queued; it re-checks its work when it runs
+            if next_run is not None and next_run <= now and planned.run_date <= now:
+                continue
+            if next_run is None or abs(next_run - planned.run_date) > TOLERANCE:
+                self.scheduler.reschedule_job(
+                    job.id, jobstore=self.jobstore, trigger='date', run_date=self._run_date(planned, now)
+                )
+                self.scheduler.modify_job(
+                    job.id, jobstore=self.jobstore, misfire_grace_time=int(planned.catch_up.total_seconds())
+                )
+                changes.rescheduled.append(planned)
+
+        existing = {job.id for job in self.scheduler.get_jobs(jobstore=self.jobstore)}
+        for job_id, planned in desired.items():
+            if job_id in existing:
+                continue
+            self.scheduler.add_job(
+                JOB_FUNCS[planned.kind],
+                'date',
+                run_date=self._run_date(planned, now),
+                args=planned.args(self.subreddit),
+                id=job_id,
+                name=job_id,
+                jobstore=self.jobstore,
+                # a job missed while the bot was down still runs on restart
+                # as long as it is inside its catch-up window
+                misfire_grace_time=int(planned.catch_up.total_seconds()),
+                coalesce=True,
+                replace_existing=True
+            )
+            changes.added.append(planned)
+
+        self._plan = desired
+        if changes:
+            logger.info(f'Planner: {changes}')
+        return changes
+
+    def timeline(self, until: Optional[datetime] = None) -> List[PlannedJob]:
+        """Return the planned jobs in run order, optionally up to ``until``."""
+        planned = sorted(self._plan.values())
+        if until is not None:
+            planned = [job for job in planned if job.run_date < until]
+        return planned
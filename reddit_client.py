@@ -1,13 +1,41 @@
-from typing import Optional, Union, Any
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Optional, Union, Any
 import asyncio
 import logging
-import asyncpraw, asyncpraw.models, asyncprawcore.exceptions
+import random
+import time
+import asyncpraw, asyncpraw.exceptions, asyncpraw.models, asyncprawcore.exceptions
 
 import config
 import discord as msg
+import metrics
+from reddit_quota import Priority, RequestScheduler
 
 logger = logging.getLogger(__name__)
 
+# refresh the OAuth token when it has less than this many seconds left
+TOKEN_REFRESH_MARGIN = 300
+TOKEN_CHECK_INTERVAL = 60
+
+# RedditAPIException item types for a post or comment Reddit has not
+# finished processing; any other error (permissions, a bad subreddit, a
+# Conflict from unstickying) is permanent and fails right away
+NOT_READY_ERROR_TYPES = {'NOT_FOUND', 'NO_THING_ID'}
+
+
+def not_ready(error: BaseException) -> bool:
+    """True if ``error`` means the item just isn't available yet"""
+    if isinstance(error, asyncprawcore.exceptions.NotFound):
+        return True
+    if isinstance(error, asyncpraw.exceptions.RedditAPIException):
+        return bool(error.items) and all(item.error_type in NOT_READY_ERROR_TYPES for item in error.items)
+    return False
+
+
+def backoff(attempt: int, base: float, cap: float) -> float:
+    """Exponential backoff with +/- 50% jitter"""
+    return min(cap, base * 2 ** attempt) * random.uniform(0.5, 1.5)
+
 class RedditAPIError(Exception):
     """Base exception for Reddit API errors"""
     pass
@@ -25,7 +53,13 @@ class RedditClient:
         self._client: Optional[asyncpraw.Reddit] = None
         self.max_retries = 3
         self.retry_delay = 5  # seconds
-        self.reddit_processing_delay = 10  # seconds after submissions/edits
+        # polling for a new post or comment to accept mod actions
+        self.ready_timeout = 30  # seconds
+        self.ready_backoff = 0.5  # first retry delay, seconds
+        self.ready_backoff_max = 5
+        self._token_lock = asyncio.Lock()
+        self.quota = RequestScheduler()
+        self._token_task: Optional[asyncio.Task] = None
     
     async def __aenter__(self):
         await self.connect()
@@ -34,6 +68,10 @@ class RedditClient:
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         await self.close()
     
+    @property
+    def connected(self) -> bool:
+        return self._client is not None
+
     @property
     def client(self) -> asyncpraw.Reddit:
         """Get the underlying Reddit client, connecting if necessary."""
@@ -54,6 +92,9 @@ class RedditClient:
             username=config.USERNAME
         )
         self._client.validate_on_submit = True
+        core = getattr(self._client, '_core', None)
+        if core is not None:
+            self.quota.attach(core.rate_limiter)
 
     async def close(self) -> None:
         """Close the Reddit client connection."""
@@ -66,14 +107,87 @@ class RedditClient:
         await self.close()
         await self.connect()
 
-    async def _execute_with_retry(self, operation, *args, **kwargs) -> Any:
-        """Execute a Reddit API operation with retries."""
+    def _authorizer(self):
+        core = getattr(self._client, '_core', None)
+        return getattr(core, 'authorizer', None)
+
+    def token_ttl(self) -> Optional[float]:
+        """Seconds until the current OAuth token expires, or None without one"""
+        authorizer = self._authorizer()
+        if authorizer is None or authorizer.access_token is None:
+            return None
+        expires = getattr(authorizer, '_expiration_timestamp_ns', None)
+        if expires is None:
+            return None
+        # asyncprawcore pads the expiry by 10s; don't count on those
+        return (expires - time.monotonic_ns()) / 1e9 - 10
+
+    async def ensure_token(self, margin: float = TOKEN_REFRESH_MARGIN) -> None:
+        """Fetch a new OAuth token if the current one is missing or about to expire"""
+        async with self._token_lock:
+            ttl = self.token_ttl()
+            if ttl is not None and ttl > margin:
+                return
+            authorizer = self._authorizer()
+            if authorizer is None:
+                return
+            await authorizer.refresh()
+            logger.info(f'Refreshed Reddit token ({"new" if ttl is None else f"{ttl:.0f}s left"})')
+
+    async def _keep_token_fresh(self) -> None:
+        while True:
+            try:
+                await self.ensure_token()
+            except Exception as e:
+                logger.warning(f'Reddit token refresh failed: {e}')
+            await asyncio.sleep(TOKEN_CHECK_INTERVAL)
+
+    async def start(self) -> None:
+        """Connect and keep the OAuth token refreshed ahead of expiry
+
+        For the long-lived shared client; one-off clients can rely on
+        asyncpraw fetching a token on first use.
+        """
+        if not self.connected:
+            await self.connect()
+        if self._token_task is None:
+            self._token_task = asyncio.create_task(self._keep_token_fresh(), name='reddit-token')
+
+    async def stop(self) -> None:
+        if self._token_task is not None:
+            self._token_task.cancel()
+            try:
+                await self._token_task
+            except asyncio.CancelledError:
+                pass
+            self._token_task = None
+        await self.close()
+
+    async def _execute_with_retry(self, operation, *args, priority: Priority = Priority.EDIT, **kwargs) -> Any:
+        """Execute a Reddit API operation with retries, once ``priority`` may spend quota."""
+        name = getattr(operation, '__qualname__', type(operation).__name__)
+        with metrics.REDDIT_CALL_SECONDS.time(operation=name):
+            try:
+                return await self._retry(name, priority, operation, *args, **kwargs)
+            except RedditAPIError:
+                metrics.REDDIT_FAILURES.inc(operation=name)
+                raise
+
+    async def _retry(self, name: str, priority: Priority, operation, *args, **kwargs) -> Any:
         last_error = None
         
         for attempt in range(self.max_retries):
             try:
-                result = await operation(*args, **kwargs)
+                async with self.quota.slot(priority):
+                    result = await operation(*args, **kwargs)
                 return result
+
+            except asyncprawcore.exceptions.TooManyRequests as e:
+                # the scheduler holds every call back until the window resets
+                last_error = e
+                metrics.REDDIT_RATE_LIMITED.inc(operation=name)
+                self.quota.exhausted(float(e.retry_after) if e.retry_after else self.retry_delay)
+                logger.warning(f"Reddit rate limit hit by {name}, retry {attempt + 1} after the window resets")
                 
             except asyncprawcore.exceptions.ServerError as e:
                 last_error = e
@@ -82,18 +196,37 @@ class RedditClient:
                     
                 wait_time = self.retry_delay * (2 ** attempt)
                 logger.warning(f"Reddit server error, retrying in {wait_time}s: {str(e)}")
+                metrics.REDDIT_RETRIES.inc(operation=name)
                 await asyncio.sleep(wait_time)
                 
-                # Refresh the client on connection errors
-                if isinstance(e, (asyncprawcore.exceptions.RequestException,
-                               asyncprawcore.exceptions.ResponseException)):
-                    await self.refresh()
+                # don't reconnect: other jobs may be using this client's
+                # session concurrently; just make sure the token is current
+                await self.ensure_token()
                     
             except Exception as e:
                 raise RedditClientError(f"Reddit operation failed: {str(e)}") from e
                 
         raise RedditServerError(f"Operation failed after {self.max_retries} attempts: {str(last_error)}")
 
+    async def _when_ready(self, operation, *args, priority: Priority = Priority.EDIT, **kwargs) -> Any:
+        """Run an action on a just-created post or comment as soon as Reddit allows
+
+        Tries right away; while Reddit reports the item as not ready yet,
+        retries with jittered backoff until ``ready_timeout``.
+        """
+        deadline = time.monotonic() + self.ready_timeout
+        attempt = 0
+        while True:
+            try:
+                return await self._execute_with_retry(operation, *args, priority=priority, **kwargs)
+            except RedditClientError as e:
+                delay = backoff(attempt, self.ready_backoff, self.ready_backoff_max)
+                if not not_ready(e.__cause__) or time.monotonic() + delay > deadline:
+                    raise
+                attempt += 1
+                logger.debug(f'{getattr(operation, "__qualname__", operation)} not ready, retry {attempt} in {delay:.1f}s')
+                await asyncio.sleep(delay)
+
     async def submit_thread(
         self,
         subreddit: str,
@@ -115,50 +248,68 @@ class RedditClient:
             subreddit_obj.submit,
             title=title,
             selftext=text,
-            send_replies=False
+            send_replies=False,
+            priority=Priority.SUBMIT
         )
         
         if mod:
-            await asyncio.sleep(self.reddit_processing_delay)
-            mod_tasks = []
-            
-            if new:
-                mod_tasks.append(self._execute_with_retry(
-                    thread.mod.suggested_sort,
-                    sort='new'
-                ))
-                
-            mod_tasks.append(self._execute_with_retry(
-                thread.mod.sticky
-            ))
-            
-            if unsticky:
-                if isinstance(unsticky, str):
-                    unsticky = await self.client.submission(id=unsticky)
-                mod_tasks.append(self._execute_with_retry(
-                    unsticky.mod.sticky,
-                    state=False
-                ))
-            
             try:
-                await asyncio.gather(*mod_tasks)
+                await self.moderate_new_thread(thread, new=new, unsticky=unsticky)
             except Exception as e:
                 logger.error(f"Moderation actions failed for thread {thread.id}: {str(e)}")
                 msg.send(f"Warning: Moderation actions failed for new thread")
                 
         return thread
 
+    async def moderate_new_thread(
+        self,
+        thread: asyncpraw.models.Submission,
+        *,
+        new: bool = False,
+        unsticky: Optional[Union[str, asyncpraw.models.Submission]] = None
+    ) -> None:
+        """Sticky a just-submitted thread, optionally sorting by new and unstickying another.
+
+        Every action is attempted; the first failure is raised afterwards.
+        """
+        mod_tasks = []
+        
+        if new:
+            mod_tasks.append(self._when_ready(
+                thread.mod.suggested_sort,
+                sort='new',
+                priority=Priority.SUBMIT
+            ))
+            
+        mod_tasks.append(self._when_ready(
+            thread.mod.sticky,
+            priority=Priority.SUBMIT
+        ))
+        
+        if unsticky:
+            mod_tasks.append(self._unsticky(unsticky))
+        
+        results = await asyncio.gather(*mod_tasks, return_exceptions=True)
+        for result in results:
+            if isinstance(result, BaseException):
+                raise result
+
+    async def _unsticky(self, thread: Union[str, asyncpraw.models.Submission]) -> None:
+        if isinstance(thread, str):
+            thread = await self.client.submission(id=thread)
+        await self._execute_with_retry(thread.mod.sticky, state=False, priority=Priority.SUBMIT)
+
     async def edit_thread(
         self,
         thread: Union[str, asyncpraw.models.Submission],
-        text: str
+        text: str,
+        priority: Priority = Priority.EDIT
     ) -> None:
         """Edit an existing thread."""
         if isinstance(thread, str):
             thread = await self.client.submission(id=thread)
             
-        await self._execute_with_retry(thread.edit, text)
-        await asyncio.sleep(self.reddit_processing_delay)
+        await self._execute_with_retry(thread.edit, text, priority=priority)
 
     async def add_comment(
         self,
@@ -166,20 +317,21 @@ class RedditClient:
         text: str,
         *,
         distinguish: bool = False,
-        sticky: bool = False
+        sticky: bool = False,
+        priority: Priority = Priority.EDIT
     ) -> Optional[asyncpraw.models.Comment]:
         """Add a comment to a thread."""
         if isinstance(thread, str):
             thread = await self.client.submission(id=thread)
             
-        comment = await self._execute_with_retry(thread.reply, text)
+        comment = await self._execute_with_retry(thread.reply, text, priority=priority)
         
         if distinguish or sticky:
-            await asyncio.sleep(self.reddit_processing_delay)
             try:
-                await self._execute_with_retry(
+                await self._when_ready(
                     comment.mod.distinguish,
-                    sticky=sticky
+                    sticky=sticky,
+                    priority=priority
                 )
             except Exception as e:
                 logger.error(f"Failed to distinguish comment {comment.id}: {str(e)}")
@@ -204,6 +356,27 @@ class RedditClient:
         return sub.widgets
 
 
+    async def get_sidebar_index(
+        self,
+        subreddit: str
+    ) -> tuple[asyncpraw.models.SubredditWidgets, dict[str, asyncpraw.models.Widget]]:
+        """List a subreddit's sidebar once and index its widgets by short name"""
+        widgets = await self.get_widgets(subreddit)
+        index = {}
+        async for w in widgets.sidebar():
+            index[w.shortName] = w
+        return widgets, index
+
+    async def update_widget(
+        self,
+        widget: asyncpraw.models.Widget,
+        priority: Priority = Priority.WIDGET,
+        **changes
+    ) -> None:
+        """Apply ``changes`` (e.g. ``text`` or ``data``) to a sidebar widget"""
+        mod: asyncpraw.models.WidgetModeration = widget.mod
+        await self._execute_with_retry(mod.update, priority=priority, **changes)
+
     async def get_image_data(
         self,
         widget: asyncpraw.models.SubredditWidgets,
@@ -211,10 +384,45 @@ class RedditClient:
         size: tuple[int, int]
     ) -> list[dict[str, Any]]:
         """Update an image widget with an uploaded image"""
-        image_url = await widget.mod.upload_image(image_path)
+        image_url = await self._execute_with_retry(widget.mod.upload_image, image_path, priority=Priority.WIDGET)
         image_data = [{'width': size[0], 'height': size[1], 'url': image_url, 'linkUrl': ''}]
         return image_data
-    
+
+    async def update_image_widgets(
+        self,
+        images: dict[str, tuple[str, tuple[int, int]]],
+        subreddit: str
+    ) -> dict[str, bool]:
+        """Update several image widgets from ``{widget name: (image path, size)}``
+
+        The sidebar is listed once; uploads and updates run concurrently.
+        Returns whether each widget was updated.
+        """
+        if '/r/' in subreddit:
+            subreddit = subreddit.split('/r/')[1]
+        widgets, index = await self.get_sidebar_index(subreddit)
+
+        async def update(widget_name: str, image_path: str, image_size: tuple[int, int]) -> bool:
+            w = index.get(widget_name)
+            if w is None:
+                msg.send(f'No widgets matching name "{widget_name}" on subreddit "{subreddit}" updated.', tag=True)
+                return False
+            try:
+                image_data = await self.get_image_data(widgets, image_path, image_size)
+                await self.update_widget(w, data=image_data)
+                msg.send(f'Updated {widget_name} widget on subreddit {subreddit}!')
+                return True
+            except Exception as e:
+                message = (
+                    f'Error while updating {widget_name} widget.\n'
+                    f'{str(e)}\n'
+                )
+                msg.send(message, tag=True)
+                return False
+
+        results = await asyncio.gather(*(update(name, *image) for name, image in images.items()))
+        return dict(zip(images, results))
+
     async def update_image_widget(
         self,
         widget_name: str,
@@ -223,26 +431,32 @@ class RedditClient:
         subreddit: str
     ) -> bool:
         """Update a subreddit's image widget"""
-        if '/r/' in subreddit:
-            subreddit = subreddit.split('/r/')[1]
-        widgets = await self.get_widgets(subreddit)
-        updated = False
-        async for w in widgets.sidebar():
-            print(w.shortName)
-            if w.shortName == widget_name:
-                try:
-                    mod: asyncpraw.models.WidgetModeration = w.mod
-                    image_data = await self.get_image_data(widgets, image_path, image_size)
-                    await mod.update(data=image_data)
-                    updated = True
-                    msg.send(f'Updated {widget_name} widget on subreddit {subreddit}!')
-                    break
-                except Exception as e:
-                    message = (
-                        f'Error while updating {widget_name} widget.\n'
-                        f'{str(e)}\n'
-                    )
-                    msg.send(message, tag=True)
-        if not updated:
-            msg.send(f'No widgets matching name "{widget_name}" on subreddit "{subreddit}" updated.', tag=True)
-        return updated
\ No newline at end of file
+        results = await self.update_image_widgets({widget_name: (image_path, image_size)}, subreddit)
+        return results[widget_name]
+
+
+_shared: Optional[RedditClient] = None
+
+
+def get_client() -> RedditClient:
+    """The process-wide client; the controller starts and stops it"""
+    global _shared
+    if _shared is None:
+        _shared = RedditClient()
+    return _shared
+
+
+@asynccontextmanager
+async def client_session(client: Optional[RedditClient] = None) -> AsyncIterator[RedditClient]:
+    """Yield ``client``, else the shared client if it is running, else a temporary one
+
+    Lets thread and widget code run both under the controller and from the
+    command line.
+    """
+    if client is None and _shared is not None and _shared.connected:
+        client = _shared
+    if client is not None:
+        yield client
+        return
+    async with RedditClient() as temporary:
+        yield temporary
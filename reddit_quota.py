@@ -0,0 +1,138 @@
+"""
+Priority scheduling of Reddit API calls against the live rate-limit quota.
+
+Every response carries ``X-Ratelimit-Remaining``, ``-Used`` and ``-Reset``.
+``RequestScheduler`` reads them from asyncprawcore's rate limiter and
+gates each call by priority: a call may only spend the quota above its
+priority's reserve, so routine edits and widget uploads back off (until
+the window resets) long before a new thread submission or a goal edit
+would have to wait. Waiting calls are admitted most urgent first.
+"""
+import asyncio
+from contextlib import asynccontextmanager
+from enum import IntEnum
+import logging
+import time
+from typing import AsyncIterator, Dict, Mapping, Optional
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(IntEnum):
+    """Lower values are more urgent"""
+    SUBMIT = 0
+    GOAL_EDIT = 1
+    EDIT = 2
+    WIDGET = 3
+
+
+# fraction of the window's requests each priority must leave unused
+RESERVES: Dict[Priority, float] = {
+    Priority.SUBMIT: 0.0,
+    Priority.GOAL_EDIT: 0.05,
+    Priority.EDIT: 0.15,
+    Priority.WIDGET: 0.40,
+}
+# assumed window until Reddit reports one (requests per 10 minutes for OAuth clients)
+DEFAULT_WINDOW = 600
+# wait at most this long between quota re-checks
+MAX_WAIT = 30
+
+
+class RequestScheduler:
+    def __init__(self, reserves: Mapping[Priority, float] = RESERVES):
+        self.reserves = dict(reserves)
+        self.remaining: Optional[float] = None
+        self.used: Optional[int] = None
+        self._reset_at = 0.0
+        self._in_flight = 0
+        self._waiting: Dict[Priority, int] = {priority: 0 for priority in Priority}
+        self._changed = asyncio.Condition()
+
+    @property
+    def window(self) -> float:
+        if self.remaining is None or self.used is None:
+            return DEFAULT_WINDOW
+        return self.remaining + self.used
+
+    def reset_in(self) -> float:
+        return max(0.0, self._reset_at - time.monotonic())
+
+    def attach(self, rate_limiter) -> None:
+        """Observe the headers of every response seen by an asyncprawcore RateLimiter"""
+        update = rate_limiter.update
+
+        def observed_update(*, response_headers):
+            update(response_headers=response_headers)
+            self.observe(response_headers)
+
+        rate_limiter.update = observed_update
+
+    def observe(self, headers: Mapping[str, str]) -> None:
+        if 'x-ratelimit-remaining' not in headers:
+            return
+        self.remaining = float(headers['x-ratelimit-remaining'])
+        self.used = int(headers.get('x-ratelimit-used', 0))
+        self._reset_at = time.monotonic() + float(headers.get('x-ratelimit-reset', 0))
+        metrics.REDDIT_QUOTA_REMAINING.set(self.remaining)
+        metrics.REDDIT_QUOTA_USED.set(self.used)
+        metrics.REDDIT_QUOTA_RESET_SECONDS.set(self.reset_in())
+        self._notify()
+
+    def exhausted(self, retry_after: Optional[float] = None) -> None:
+        """Record a 429: nothing may run until the window resets"""
+        self.remaining = 0
+        if retry_after:
+            self._reset_at = time.monotonic() + retry_after
+        metrics.REDDIT_QUOTA_REMAINING.set(0)
+        self._notify()
+
+    def _notify(self) -> None:
+        async def notify():
+            async with self._changed:
+                self._changed.notify_all()
+        try:
+            asyncio.get_running_loop().create_task(notify())
+        except RuntimeError:
+            pass
+
+    def _can_run(self, priority: Priority) -> bool:
+        if any(self._waiting[p] for p in Priority if p < priority):
+            return False
+        if self.remaining is None or self.reset_in() == 0:
+            # no quota known yet, or the window has rolled over
+            return True
+        available = self.remaining - self._in_flight
+        return available > max(self.reserves[priority] * self.window, 0)
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority = Priority.EDIT) -> AsyncIterator[None]:
+        """Wait until ``priority`` may spend quota, then hold one request"""
+        start = time.monotonic()
+        async with self._changed:
+            self._waiting[priority] += 1
+            metrics.REDDIT_QUEUED.set(self._waiting[priority], priority=priority.name)
+            try:
+                while not self._can_run(priority):
+                    timeout = min(MAX_WAIT, self.reset_in() or MAX_WAIT)
+                    try:
+                        await asyncio.wait_for(self._changed.wait(), timeout)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self._waiting[priority] -= 1
+                metrics.REDDIT_QUEUED.set(self._waiting[priority], priority=priority.name)
+                # lower priorities may be waiting on us
+                self._changed.notify_all()
+            self._in_flight += 1
+        waited = time.monotonic() - start
+        metrics.REDDIT_QUEUE_WAIT_SECONDS.observe(waited, priority=priority.name)
+        if waited > 1:
+            logger.info(f'{priority.name} Reddit call waited {waited:.1f}s for quota ({self.remaining} left)')
+        try:
+            yield
+        finally:
+            self._in_flight -= 1
+            self._notify()
@@ -0,0 +1,256 @@
+"""
+Persisted, in-memory indexed copy of the season schedule.
+
+Matches are kept sorted by ``planned_kickoff_time`` with secondary indices
+by team, competition and status, so schedule lookups are bisects over
+memory rather than API calls. ``refresh`` pulls the season and rewrites
+only the rows whose content changed; a full-season refresh also drops
+matches the feed no longer returns.
+"""
+from bisect import bisect_left, bisect_right, insort
+from collections import defaultdict
+from datetime import date, datetime, time as dt_time, timedelta
+import hashlib
+import logging
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from api_client import MLSApiClient
+import db
+from models.schedule import MatchSchedule
+
+logger = logging.getLogger(__name__)
+
+SCHEDULE_DB = 'data/schedule.db'
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS schedule (
+        match_id TEXT PRIMARY KEY,
+        season_id TEXT,
+        kickoff REAL,
+        competition_id TEXT,
+        status TEXT,
+        home_team_id TEXT,
+        away_team_id TEXT,
+        row_hash TEXT NOT NULL,
+        payload TEXT NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_schedule_season ON schedule (season_id)',
+]
+
+
+def _row_hash(payload: str) -> str:
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _first(entry: Tuple[float, str]) -> float:
+    return entry[0]
+
+
+def _kickoff(match: MatchSchedule) -> Optional[float]:
+    return match.planned_kickoff_time.timestamp() if match.planned_kickoff_time else None
+
+
+class ScheduleIndex:
+    def __init__(self, path: str = SCHEDULE_DB):
+        self.db = db.get_database(path)
+        self._matches: Dict[str, MatchSchedule] = {}
+        self._hashes: Dict[str, str] = {}
+        # (kickoff, match_id) pairs in kickoff order
+        self._timeline: List[Tuple[float, str]] = []
+        self._by_team: Dict[str, List[Tuple[float, str]]] = defaultdict(list)
+        self._by_competition: Dict[str, Set[str]] = defaultdict(set)
+        self._by_status: Dict[str, Set[str]] = defaultdict(set)
+        with self.db.transaction() as con:
+            for statement in SCHEMA:
+                con.execute(statement)
+        self.load()
+
+    def load(self) -> None:
+        """Rebuild the in-memory indices from the database."""
+        rows = self.db.execute('SELECT row_hash, payload FROM schedule')
+        self._matches.clear()
+        self._hashes.clear()
+        for row_hash, payload in rows:
+            match = MatchSchedule.model_validate_json(payload)
+            self._matches[match.match_id] = match
+            self._hashes[match.match_id] = row_hash
+        self._reindex()
+        logger.debug(f'Loaded {len(self._matches)} scheduled matches')
+
+    def _reindex(self) -> None:
+        self._timeline = []
+        self._by_team = defaultdict(list)
+        self._by_competition = defaultdict(set)
+        self._by_status = defaultdict(set)
+        for match in self._matches.values():
+            self._index(match)
+        self._timeline.sort()
+        for entries in self._by_team.values():
+            entries.sort()
+
+    def _index(self, match: MatchSchedule, ordered: bool = False) -> None:
+        self._by_competition[match.competition_id].add(match.match_id)
+        self._by_status[match.match_status].add(match.match_id)
+        kickoff = _kickoff(match)
+        if kickoff is None:
+            return
+        entry = (kickoff, match.match_id)
+        add = insort if ordered else list.append
+        add(self._timeline, entry)
+        add(self._by_team[match.home_team_id], entry)
+        add(self._by_team[match.away_team_id], entry)
+
+    def _unindex(self, match: MatchSchedule) -> None:
+        self._by_competition[match.competition_id].discard(match.match_id)
+        self._by_status[match.match_status].discard(match.match_id)
+        kickoff = _kickoff(match)
+        if kickoff is None:
+            return
+        entry = (kickoff, match.match_id)
+        for entries in (self._timeline, self._by_team[match.home_team_id], self._by_team[match.away_team_id]):
+            i = bisect_left(entries, entry)
+            if i < len(entries) and entries[i] == entry:
+                del entries[i]
+
+    def _diff(self, matches: Iterable[MatchSchedule]) -> Tuple[List[MatchSchedule], List[tuple]]:
+        """Return the matches whose content changed and their database rows."""
+        changed: List[MatchSchedule] = []
+        rows = []
+        for match in matches:
+            payload = match.model_dump_json()
+            row_hash = _row_hash(payload)
+            if self._hashes.get(match.match_id) == row_hash:
+                continue
+            changed.append(match)
+            rows.append((
+                match.match_id, match.season_id, _kickoff(match), match.competition_id,
+                match.match_status, match.home_team_id, match.away_team_id, row_hash, payload
+            ))
+        return changed, rows
+
+    def _write(self, rows: List[tuple]) -> None:
+        self.db.executemany(
+            '''INSERT OR REPLACE INTO schedule
+               (match_id, season_id, kickoff, competition_id, status, home_team_id, away_team_id, row_hash, payload)
+               VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)''',
+            rows
+        )
+
+    def _apply(self, changed: List[MatchSchedule], rows: List[tuple]) -> None:
+        for match, row in zip(changed, rows):
+            previous = self._matches.get(match.match_id)
+            if previous is not None:
+                self._unindex(previous)
+            self._matches[match.match_id] = match
+            self._hashes[match.match_id] = row[7]
+            self._index(match, ordered=True)
+        if changed:
+            logger.info(f'Schedule index: {len(changed)} matches added or changed')
+
+    def _delete(self, match_ids: List[str]) -> None:
+        self.db.executemany('DELETE FROM schedule WHERE match_id = ?', [(match_id,) for match_id in match_ids])
+
+    def _drop(self, match_ids: List[str]) -> None:
+        for match_id in match_ids:
+            self._unindex(self._matches.pop(match_id))
+            self._hashes.pop(match_id, None)
+        if match_ids:
+            logger.info(f'Schedule index: {len(match_ids)} matches removed')
+
+    def _stale(self, season: str, matches: List[MatchSchedule]) -> List[str]:
+        """IDs of stored ``season`` matches (or ones without a season) missing from a full fetch of it."""
+        if not matches:
+            # an empty feed is an outage, not a cancelled season
+            return []
+        fetched = {match.match_id for match in matches}
+        return [
+            match_id for match_id, match in self._matches.items()
+            if match.season_id in (season, None) and match_id not in fetched
+        ]
+
+    def remove(self, match_ids: Iterable[str]) -> None:
+        """Delete matches from the index."""
+        match_ids = [match_id for match_id in match_ids if match_id in self._matches]
+        if match_ids:
+            self._delete(match_ids)
+            self._drop(match_ids)
+
+    def upsert(self, matches: Iterable[MatchSchedule]) -> List[MatchSchedule]:
+        """Store matches, writing only the rows whose content changed.
+
+        Returns the matches that were added or changed.
+        """
+        changed, rows = self._diff(matches)
+        if rows:
+            self._write(rows)
+            self._apply(changed, rows)
+        return changed
+
+    async def refresh(self, client: MLSApiClient, season: str, **kwargs) -> List[MatchSchedule]:
+        """Pull the season schedule and store what changed.
+
+        Extra keyword arguments are passed to ``get_full_schedule`` to
+        narrow the refresh, e.g. to a date window. Without them the whole
+        season is fetched, and stored matches of the season it no longer
+        contains are removed. Only the database writes leave the event loop;
+        the in-memory indices are updated here.
+        """
+        matches = await client.get_full_schedule(season=season, **kwargs)
+        changed, rows = self._diff(matches)
+        if rows:
+            await self.db.run(self._write, rows)
+            self._apply(changed, rows)
+        if not kwargs:
+            stale = self._stale(season, matches)
+            if stale:
+                await self.db.run(self._delete, stale)
+                self._drop(stale)
+        return changed
+
+    def get(self, match_id: str) -> Optional[MatchSchedule]:
+        return self._matches.get(match_id)
+
+    def range(self, start: datetime, end: datetime, team_id: Optional[str] = None) -> List[MatchSchedule]:
+        """Return matches kicking off in ``[start, end)``, optionally for one team."""
+        entries = self._by_team.get(team_id, []) if team_id else self._timeline
+        lo = bisect_left(entries, start.timestamp(), key=_first)
+        hi = bisect_left(entries, end.timestamp(), key=_first)
+        return [self._matches[match_id] for _, match_id in entries[lo:hi]]
+
+    def next_match(self, team_id: str, after: Optional[datetime] = None) -> Optional[MatchSchedule]:
+        """Return the first match for a team kicking off after ``after`` (default now)."""
+        after = after or datetime.now().astimezone()
+        entries = self._by_team.get(team_id, [])
+        i = bisect_right(entries, after.timestamp(), key=_first)
+        if i >= len(entries):
+            return None
+        return self._matches[entries[i][1]]
+
+    def matches_on(self, day: Optional[date] = None, team_id: Optional[str] = None) -> List[MatchSchedule]:
+        """Return matches on a local calendar day (default today)."""
+        day = day or date.today()
+        start = datetime.combine(day, dt_time.min).astimezone()
+        return self.range(start, start + timedelta(days=1), team_id)
+
+    def by_competition(self, competition_id: str) -> List[MatchSchedule]:
+        return self._sorted(self._by_competition.get(competition_id, ()))
+
+    def by_status(self, status: str) -> List[MatchSchedule]:
+        return self._sorted(self._by_status.get(status, ()))
+
+    def _sorted(self, match_ids: Iterable[str]) -> List[MatchSchedule]:
+        matches = [self._matches[match_id] for match_id in match_ids]
+        return sorted(matches, key=lambda m: _kickoff(m) or float('inf'))
+
+    def __len__(self) -> int:
+        return len(self._matches)
+
+
+_index: Optional[ScheduleIndex] = None
+
+
+def get_index() -> ScheduleIndex:
+    global _index
+    if _index is None:
+        _index = ScheduleIndex()
+    return _index
@@ -1,9 +1,13 @@
 import asyncio
 from dataclasses import dataclass, field
 import json
+import logging
 import os
 import tempfile
-from typing import Dict, Optional
+import threading
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -14,6 +18,8 @@ class MatchThreads():
     pre: Optional[str] = None
     post: Optional[str] = None
     stream_link: Optional[str] = field(default=None, metadata={"json_key": "stream-link"})
+    # set once the match thread has made its final update
+    final: bool = False
 
     @classmethod
     def from_dict(cls, data: Dict) -> 'MatchThreads':
@@ -22,7 +28,8 @@ class MatchThreads():
             match=data.get("match"),
             pre=data.get("pre"),
             post=data.get("post"),
-            stream_link=data.get("stream-link")
+            stream_link=data.get("stream-link"),
+            final=data.get("final", False)
         )
 
     def to_dict(self) -> Dict:
@@ -35,43 +42,142 @@ class MatchThreads():
             result["post"] = self.post
         if self.stream_link:
             result["stream-link"] = self.stream_link
+        if self.final:
+            result["final"] = True
         return result
 
-class ThreadManager:
-    """Manages match thread data persistence"""
-    def __init__(self, filename: str):
+
+class ThreadJournal:
+    """Append-only journal of thread mutations on top of a JSON snapshot.
+
+    The snapshot keeps the original ``threads.json`` format. Every mutation
+    is appended as one JSON line to ``<snapshot>.journal``; appends made
+    within ``fsync_delay`` seconds of each other share a single write and
+    fsync on a worker thread. Appends return once buffered unless they ask
+    to wait for the fsync. Once the journal grows past
+    ``compact_threshold`` bytes it is folded into a new snapshot in the
+    background.
+    """
+    def __init__(self, filename: str, fsync_delay: float = 0.5, compact_threshold: int = 64 * 1024):
         self.filename = filename
-        self.threads: Dict[str, MatchThreads] = {}
-        self._lock: Optional[asyncio.Lock] = None
-        self.load()
+        self.journal_filename = f'{filename}.journal'
+        self.fsync_delay = fsync_delay
+        self.compact_threshold = compact_threshold
+        # guards the files; writes and compaction run on worker threads
+        self._file_lock = threading.Lock()
+        self._pending: List[Tuple[str, Optional[asyncio.Future]]] = []
+        self._flush_task: Optional[asyncio.Task] = None
+        self._compact_task: Optional[asyncio.Task] = None
+        # journals are shared per file; tasks belong to the loop that made them
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
 
-    def _get_lock(self) -> asyncio.Lock:
-        if self._lock is None:
-            self._lock = asyncio.Lock()
-        return self._lock
+    def load(self) -> Dict[str, Dict]:
+        """Return the snapshot with every journal record replayed on top."""
+        with self._file_lock:
+            return self._read_state()
 
-    def load(self) -> None:
+    def _read_state(self) -> Dict[str, Dict]:
         try:
             with open(self.filename, 'r') as f:
                 data = json.load(f)
-                self.threads = {
-                    sportec_id: MatchThreads.from_dict(thread_data)
-                    for sportec_id, thread_data in data.items()
-                }
         except FileNotFoundError:
-            self.threads = {}
+            data = {}
+        try:
+            with open(self.journal_filename, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # torn final line from a crash mid-append
+                        logger.warning(f'Skipping unreadable record in {self.journal_filename}')
+                        continue
+                    if record.get('op') == 'delete':
+                        data.pop(record['id'], None)
+                    else:
+                        data[record['id']] = record['data']
+        except FileNotFoundError:
+            pass
+        return data
 
-    async def save(self) -> None:
-        async with self._get_lock():
-            data = {
-                sportec_id: thread.to_dict()
-                for sportec_id, thread in self.threads.items()
-            }
+    def _bind_loop(self) -> asyncio.AbstractEventLoop:
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._flush_task = None
+            self._compact_task = None
+            # nobody is left waiting on futures from the old loop
+            self._pending = [(line, None) for line, _ in self._pending]
+        return loop
+
+    async def append(self, sportec_id: str, data: Optional[Dict], durable: bool = False) -> None:
+        """Journal a new value for one match (``None`` deletes it).
+
+        Returns once the record is buffered for the next group commit, or
+        with ``durable`` once it has been written and fsynced.
+        """
+        if data is None:
+            record = {'op': 'delete', 'id': sportec_id}
+        else:
+            record = {'op': 'put', 'id': sportec_id, 'data': data}
+        loop = self._bind_loop()
+        future = loop.create_future() if durable else None
+        self._pending.append((json.dumps(record) + '\n', future))
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = loop.create_task(self._flush_later())
+        if future is not None:
+            await future
+
+    async def _flush_later(self) -> None:
+        await asyncio.sleep(self.fsync_delay)
+        await self.flush()
+
+    async def flush(self) -> None:
+        """Write out every pending record now."""
+        self._bind_loop()
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        try:
+            size = await asyncio.to_thread(self._write_batch, [line for line, _ in batch])
+        except Exception as e:
+            logger.error(f'Failed to write {self.journal_filename}: {e}')
+            # buffered records nobody waited on are retried by the next flush
+            self._pending[:0] = [(line, None) for line, future in batch if future is None]
+            for _, future in batch:
+                if future is not None and not future.done():
+                    future.set_exception(e)
+            return
+        for _, future in batch:
+            if future is not None and not future.done():
+                future.set_result(None)
+        if size > self.compact_threshold and (self._compact_task is None or self._compact_task.done()):
+            self._compact_task = asyncio.create_task(self.compact())
+
+    def _write_batch(self, lines: List[str]) -> int:
+        with self._file_lock:
+            with open(self.journal_filename, 'a') as f:
+                f.write(''.join(lines))
+                f.flush()
+                os.fsync(f.fileno())
+                return f.tell()
+
+    async def compact(self) -> None:
+        """Fold the journal into a fresh snapshot without blocking the loop."""
+        try:
+            await asyncio.to_thread(self._compact)
+        except Exception as e:
+            logger.error(f'Failed to compact {self.journal_filename}: {e}')
+
+    def _compact(self) -> None:
+        with self._file_lock:
+            data = self._read_state()
             dir_name = os.path.dirname(os.path.abspath(self.filename))
             fd, tmp_path = tempfile.mkstemp(dir=dir_name, suffix='.tmp')
             try:
                 with os.fdopen(fd, 'w') as f:
                     json.dump(data, f, indent=4)
+                    f.flush()
+                    os.fsync(f.fileno())
                 os.replace(tmp_path, self.filename)
             except BaseException:
                 try:
@@ -79,10 +185,55 @@ class ThreadManager:
                 except OSError:
                     pass
                 raise
+            # the snapshot now holds every record, so the journal can go
+            try:
+                os.unlink(self.journal_filename)
+            except FileNotFoundError:
+                pass
+        logger.info(f'Compacted {self.journal_filename} into {self.filename}')
+
+
+# one journal and one thread map per file, shared by every ThreadManager in the process
+_journals: Dict[str, ThreadJournal] = {}
+_threads: Dict[str, Dict[str, MatchThreads]] = {}
+
+
+def get_journal(filename: str) -> ThreadJournal:
+    key = os.path.abspath(filename)
+    if key not in _journals:
+        _journals[key] = ThreadJournal(filename)
+    return _journals[key]
+
+
+class ThreadManager:
+    """Manages match thread data persistence"""
+    def __init__(self, filename: str):
+        self.filename = filename
+        self.journal = get_journal(filename)
+        key = os.path.abspath(filename)
+        if key not in _threads:
+            _threads[key] = {}
+            self.threads: Dict[str, MatchThreads] = _threads[key]
+            self.load()
+        else:
+            self.threads = _threads[key]
+
+    def load(self) -> None:
+        data = self.journal.load()
+        self.threads.clear()
+        self.threads.update({
+            sportec_id: MatchThreads.from_dict(thread_data)
+            for sportec_id, thread_data in data.items()
+        })
+
+    async def save(self) -> None:
+        """Flush pending journal records and compact them into the snapshot."""
+        await self.journal.flush()
+        await self.journal.compact()
 
     async def add_threads(self, sportec_id: str, thread: MatchThreads) -> None:
         self.threads[sportec_id] = thread
-        await self.save()
+        await self.journal.append(sportec_id, thread.to_dict())
 
     def get_threads(self, sportec_id: str) -> Optional[MatchThreads]:
         return self.threads.get(sportec_id)
@@ -93,4 +244,4 @@ class ThreadManager:
             for key, value in kwargs.items():
                 if hasattr(thread, key):
                     setattr(thread, key, value)
-            await self.save()
+            await self.journal.append(sportec_id, thread.to_dict())
@@ -1,23 +1,28 @@
 from time import time
 import traceback
 import logging
-import sqlite3
 import inspect
 import json
-import asyncpraw
 import asyncio
 import signal
-import subprocess
 from datetime import datetime, timezone
 from collections import namedtuple
 from typing import Any
 
 import config
+import db
 import discord as msg
 import functools
 
 mls_db = 'mls.db'
 
+# BeautifulSoup backend: lxml is much faster, html.parser ships with Python
+try:
+    import lxml  # noqa: F401
+    HTML_PARSER = 'lxml'
+except ImportError:
+    HTML_PARSER = 'html.parser'
+
 formatter = logging.Formatter('%(asctime)s | %(levelname)s | %(message)s')
 
 loggers = {}
@@ -104,26 +109,13 @@ def iso_to_epoch(t):
 
 
 def db_query(query: str, data: tuple=None):
-    retval = None
-    try:
-        con = sqlite3.connect(mls_db)
-        cur = con.cursor()
-        if data is not None:
-            retval = cur.execute(query, data)
-        else:
-            retval = cur.execute(query)
-        logging.debug(query)
-        if cur.rowcount > -1:
-            logging.debug(f'{cur.rowcount} rows affected.')
-        retval = retval.fetchall()
-        con.commit()
-        logging.debug(query)
-    except Exception as e:
-        logging.error(f'Database error: {str(e)}\n{traceback.format_exc()}\nQuery: {query}')
-        raise
-    finally:
-        con.close()
-    return retval
+    """Run a query against mls.db on this thread's pooled connection."""
+    return db.get_database(mls_db).execute(query, data)
+
+
+async def async_db_query(query: str, data: tuple=None):
+    """Run a query against mls.db without blocking the event loop."""
+    return await db.get_database(mls_db).async_execute(query, data)
 
 
 def write_json(data, filename):
@@ -143,21 +135,6 @@ def read_json(filename):
         return data
 
 
-def file_changed(filename):
-    changes = subprocess.run(f'git status {filename}', capture_output=True, shell=True, text=True).stdout
-    logging.debug(changes)
-    if 'Changes not staged' in changes:
-        message = f'{filename} changed.'
-        logging.info(message)
-        msg.send(message, tag=True)
-        return True
-    else:
-        message = f'No changes to {filename}.'
-        logging.info(message)
-        msg.send(message)
-        return False
-
-
 Names = namedtuple('Names', 'full_name short_name abbrev sportec_id')
 
 # a dict of namedtuples with each club's full/short/abbrev names
@@ -226,17 +203,6 @@ names = {
 }
 
 
-def get_reddit() -> asyncpraw.Reddit:
-    reddit = asyncpraw.Reddit(
-        client_id=config.CLIENT_ID,
-        client_secret=config.SECRET_TOKEN,
-        password=config.PASSWORD,
-        user_agent=config.USER_AGENT_STR,
-        username=config.USERNAME
-    )
-    reddit.validate_on_submit = True
-    return reddit
-
 def normalize_datetime(v: Any) -> datetime:
     """
     Take a datetime string or object and return a UTC datetime.
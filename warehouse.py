@@ -0,0 +1,237 @@
+"""
+Local history of match data, one snapshot per Match refresh.
+
+Each snapshot is stored as the delta against the previous one, with a full
+keyframe every ``keyframe_interval`` snapshots so reconstruction never has
+to replay more than that many deltas.
+"""
+import json
+import logging
+import threading
+import time
+import zlib
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import db
+from models.match import ComprehensiveMatchData
+
+logger = logging.getLogger(__name__)
+
+WAREHOUSE_DB = 'data/warehouse.db'
+
+SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS match_snapshots (
+        match_id TEXT NOT NULL,
+        seq INTEGER NOT NULL,
+        ts REAL NOT NULL,
+        season_id TEXT,
+        keyframe INTEGER NOT NULL,
+        payload BLOB NOT NULL,
+        PRIMARY KEY (match_id, seq)
+    )''',
+    'CREATE INDEX IF NOT EXISTS idx_snapshots_match_ts ON match_snapshots (match_id, ts)',
+    'CREATE INDEX IF NOT EXISTS idx_snapshots_season ON match_snapshots (season_id, match_id, seq)',
+]
+
+
+def diff(old: Any, new: Any, path: Optional[List] = None) -> List[List]:
+    """Return the ops that turn ``old`` into ``new``.
+
+    Ops are ``["set", path, value]``, ``["del", path]`` and
+    ``["ext", path, items]`` (append to a list), where ``path`` is a list
+    of dict keys and list indices.
+    """
+    path = path or []
+    if isinstance(old, dict) and isinstance(new, dict):
+        ops = []
+        for key, value in new.items():
+            if key not in old:
+                ops.append(['set', path + [key], value])
+            else:
+                ops.extend(diff(old[key], value, path + [key]))
+        for key in old:
+            if key not in new:
+                ops.append(['del', path + [key]])
+        return ops
+    if isinstance(old, list) and isinstance(new, list):
+        if len(new) == len(old):
+            ops = []
+            for i, (a, b) in enumerate(zip(old, new)):
+                ops.extend(diff(a, b, path + [i]))
+            return ops
+        if len(new) > len(old) and new[:len(old)] == old:
+            # feeds like match events only ever grow at the end
+            return [['ext', path, new[len(old):]]]
+        return [['set', path, new]]
+    if old != new or type(old) is not type(new):
+        return [['set', path, new]]
+    return []
+
+
+def apply(state: Any, ops: List[List]) -> Any:
+    """Apply ops from ``diff`` to ``state`` in place and return it."""
+    for op in ops:
+        kind, path = op[0], op[1]
+        if not path:
+            state = op[2] if kind == 'set' else state + op[2]
+            continue
+        parent = state
+        for key in path[:-1]:
+            parent = parent[key]
+        key = path[-1]
+        if kind == 'set':
+            parent[key] = op[2]
+        elif kind == 'del':
+            del parent[key]
+        elif kind == 'ext':
+            parent[key].extend(op[2])
+    return state
+
+
+def _encode(value: Any) -> bytes:
+    return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+
+def _decode(payload: bytes) -> Any:
+    return json.loads(zlib.decompress(payload))
+
+
+def _season_id(data: ComprehensiveMatchData) -> Optional[str]:
+    if data.match_base is not None:
+        return data.match_base.match_information.season_id
+    if data.match_info is not None:
+        return data.match_info.season.sportecId
+    return None
+
+
+class MatchWarehouse:
+    """Delta-compressed snapshot history for ComprehensiveMatchData."""
+    def __init__(self, path: str = WAREHOUSE_DB, keyframe_interval: int = 30):
+        self.db = db.get_database(path)
+        self.keyframe_interval = keyframe_interval
+        # latest (seq, state, keyframe seq) per match, so recording never reads back
+        self._latest: Dict[str, Tuple[int, Dict, int]] = {}
+        self._lock = threading.Lock()
+        with self.db.transaction() as con:
+            for statement in SCHEMA:
+                con.execute(statement)
+
+    def record(self, match_id: str, data: ComprehensiveMatchData, ts: Optional[float] = None) -> bool:
+        """Store a snapshot of ``data``. Returns False if nothing changed."""
+        ts = ts if ts is not None else time.time()
+        state = data.model_dump(mode='json', exclude={'errors'})
+        with self._lock:
+            latest = self._latest.get(match_id) or self._load_latest(match_id)
+            if latest is None:
+                seq, keyframe_seq, ops = 0, 0, None
+            else:
+                prev_seq, prev_state, keyframe_seq = latest
+                ops = diff(prev_state, state)
+                if not ops:
+                    return False
+                seq = prev_seq + 1
+            keyframe = ops is None or seq - keyframe_seq >= self.keyframe_interval
+            payload = _encode(state if keyframe else ops)
+            self.db.execute(
+                'INSERT INTO match_snapshots (match_id, seq, ts, season_id, keyframe, payload) VALUES (?, ?, ?, ?, ?, ?)',
+                (match_id, seq, ts, _season_id(data), int(keyframe), payload)
+            )
+            self._latest[match_id] = (seq, state, seq if keyframe else keyframe_seq)
+        return True
+
+    async def async_record(self, match_id: str, data: ComprehensiveMatchData, ts: Optional[float] = None) -> bool:
+        return await self.db.run(self.record, match_id, data, ts)
+
+    def _load_latest(self, match_id: str) -> Optional[Tuple[int, Dict, int]]:
+        rows = self.db.execute(
+            'SELECT MAX(seq) FROM match_snapshots WHERE match_id = ?',
+            (match_id,)
+        )
+        if not rows or rows[0][0] is None:
+            return None
+        seq = rows[0][0]
+        state, keyframe_seq = self._replay(match_id, seq)
+        self._latest[match_id] = (seq, state, keyframe_seq)
+        return self._latest[match_id]
+
+    def _replay(self, match_id: str, seq: int) -> Tuple[Dict, int]:
+        """Rebuild the state at ``seq`` from the nearest keyframe at or before it."""
+        rows = self.db.execute(
+            '''SELECT seq, keyframe, payload FROM match_snapshots
+               WHERE match_id = ? AND seq <= ?
+                 AND seq >= (SELECT MAX(seq) FROM match_snapshots
+                             WHERE match_id = ? AND seq <= ? AND keyframe = 1)
+               ORDER BY seq''',
+            (match_id, seq, match_id, seq)
+        )
+        state, keyframe_seq = None, 0
+        for row_seq, keyframe, payload in rows:
+            if keyframe:
+                state, keyframe_seq = _decode(payload), row_seq
+            else:
+                state = apply(state, _decode(payload))
+        return state, keyframe_seq
+
+    def state_at(self, match_id: str, ts: Optional[float] = None) -> Optional[Dict]:
+        """Return the stored state of a match as of ``ts`` (default: latest)."""
+        if ts is None:
+            rows = self.db.execute('SELECT MAX(seq) FROM match_snapshots WHERE match_id = ?', (match_id,))
+        else:
+            rows = self.db.execute(
+                'SELECT MAX(seq) FROM match_snapshots WHERE match_id = ? AND ts <= ?',
+                (match_id, ts)
+            )
+        if not rows or rows[0][0] is None:
+            return None
+        state, _ = self._replay(match_id, rows[0][0])
+        return state
+
+    def data_at(self, match_id: str, ts: Optional[float] = None) -> Optional[ComprehensiveMatchData]:
+        """Like ``state_at``, parsed back into ComprehensiveMatchData."""
+        state = self.state_at(match_id, ts)
+        if state is None:
+            return None
+        return ComprehensiveMatchData.model_validate(state)
+
+    def timestamps(self, match_id: str) -> List[float]:
+        """Return the timestamps of every stored snapshot for a match."""
+        rows = self.db.execute(
+            'SELECT ts FROM match_snapshots WHERE match_id = ? ORDER BY seq',
+            (match_id,)
+        )
+        return [row[0] for row in rows]
+
+    def iter_season(self, season_id: str) -> Iterator[Tuple[str, float, Dict]]:
+        """Yield ``(match_id, ts, state)`` for every snapshot in a season.
+
+        Snapshots are read in one ordered pass and each match's state is
+        rolled forward incrementally. The yielded state is reused for the
+        next snapshot of the same match, so copy it if you keep it.
+        """
+        cur = self.db.connection().execute(
+            '''SELECT match_id, ts, keyframe, payload FROM match_snapshots
+               WHERE season_id = ? ORDER BY match_id, seq''',
+            (season_id,)
+        )
+        current_id, state = None, None
+        for match_id, ts, keyframe, payload in cur:
+            if match_id != current_id:
+                current_id, state = match_id, None
+            if keyframe:
+                state = _decode(payload)
+            elif state is None:
+                # history before the first keyframe is not reconstructable
+                continue
+            else:
+                state = apply(state, _decode(payload))
+            yield match_id, ts, state
+
+
+_warehouse: Optional[MatchWarehouse] = None
+
+
+def get_warehouse() -> MatchWarehouse:
+    global _warehouse
+    if _warehouse is None:
+        _warehouse = MatchWarehouse()
+    return _warehouse
@@ -0,0 +1,372 @@
+"""
+Standings and schedule widget images drawn from MLS API data.
+
+Replaces the mlssoccer.com screenshots taken by ``mls_playwright``: the
+standings table comes from the Sport API and the "This Week" / "Next
+Week" schedule from the schedule index (or the Stats API), drawn with PIL
+using cached club logos. Images go through ``image_pipeline`` so unchanged
+ones are not re-uploaded. Layouts can be overridden per widget with the
+``widget_layouts`` flag.
+"""
+import argparse
+import asyncio
+from dataclasses import dataclass, fields, replace
+from datetime import datetime, timedelta
+import io
+import logging
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+from pydantic import ValidationError
+
+from api_client import MLSApiClient, MLSApiError
+import clubs
+from config import FEATURE_FLAGS, SUB, TEAMS
+import discord as msg
+import image_pipeline
+from models.club import Club_Sport
+from models.constants import get_current_season
+from models.schedule import MatchSchedule
+import schedule_index
+import widgets
+
+logger = logging.getLogger(__name__)
+
+LOGO_DIR = f'{image_pipeline.PNG_DIR}/logos'
+# logos are downloaded at this size and scaled down per layout
+LOGO_SIZE = 96
+# weeks ahead searched for the two schedule images
+SCHEDULE_WEEKS = 4
+
+Color = Tuple[int, int, int]
+
+
+@dataclass(frozen=True)
+class Layout:
+    width: int = 375
+    title_height: int = 40
+    header_height: int = 28
+    row_height: int = 36
+    logo_size: int = 24
+    margin: int = 10
+    font_path: Optional[str] = None
+    font_size: int = 14
+    title_size: int = 18
+    background: Color = (255, 255, 255)
+    text: Color = (17, 17, 17)
+    muted: Color = (110, 110, 110)
+    title_background: Color = (12, 35, 64)
+    title_text: Color = (255, 255, 255)
+    stripe: Color = (244, 245, 247)
+    highlight: Color = (255, 231, 239)
+    rule: Color = (220, 220, 220)
+
+    @classmethod
+    def for_widget(cls, name: str) -> 'Layout':
+        """The default layout with this widget's ``widget_layouts`` overrides"""
+        overrides = dict(FEATURE_FLAGS.get('widget_layouts', {}).get(name, {}))
+        known = {f.name for f in fields(cls)}
+        for key in set(overrides) - known:
+            logger.warning(f'Unknown layout option {key} for {name} widget')
+            overrides.pop(key)
+        for key, value in overrides.items():
+            if isinstance(value, list):
+                overrides[key] = tuple(value)
+        return replace(cls(), **overrides)
+
+    def font(self, size: Optional[int] = None) -> ImageFont.ImageFont:
+        size = size or self.font_size
+        if self.font_path:
+            try:
+                return ImageFont.truetype(self.font_path, size)
+            except OSError as e:
+                logger.warning(f'Could not load font {self.font_path}: {e}')
+        return ImageFont.load_default(size=size)
+
+
+@dataclass
+class StandingsRow:
+    position: int
+    opta_id: Optional[int]
+    name: str
+    points: int
+    played: int
+    wins: int
+    losses: int
+    draws: int
+    goal_difference: int
+    logo_url: Optional[str] = None
+
+
+def _stat(entry: Dict, *keys: str, default: Any = 0) -> Any:
+    """First of ``keys`` found on a standings entry or its statistics"""
+    for source in (entry, entry.get('statistics') or {}):
+        for key in keys:
+            if source.get(key) is not None:
+                return source[key]
+    return default
+
+
+def _logo_url(club: Dict, size: int = LOGO_SIZE) -> Optional[str]:
+    try:
+        return Club_Sport.model_validate(club).get_logo_url(width=size, height=size)
+    except ValidationError:
+        url = club.get('logoColorUrl')
+        return url.replace('{formatInstructions}', f'w_{size},h_{size},c_pad/f_auto') if url else None
+
+
+def parse_standings(data: Any) -> Dict[str, List[StandingsRow]]:
+    """Standings tables by group name from a Sport API standings response"""
+    groups = data if isinstance(data, list) else data.get('groups') or data.get('standings') or []
+    tables: Dict[str, List[StandingsRow]] = {}
+    for group in groups:
+        name = group.get('name') or group.get('group_name') or 'Standings'
+        rows = []
+        for entry in group.get('standings') or group.get('entries') or []:
+            club = entry.get('club') or {}
+            opta_id = club.get('optaId') or entry.get('club_opta_id')
+            rows.append(StandingsRow(
+                position=int(_stat(entry, 'position', 'rank')),
+                opta_id=int(opta_id) if opta_id else None,
+                name=club.get('shortName') or club.get('fullName') or entry.get('club_name', ''),
+                points=int(_stat(entry, 'total_points', 'points')),
+                played=int(_stat(entry, 'total_matches', 'matches_played', 'games_played')),
+                wins=int(_stat(entry, 'total_wins', 'wins')),
+                losses=int(_stat(entry, 'total_losses', 'losses')),
+                draws=int(_stat(entry, 'total_draws', 'draws', 'ties')),
+                goal_difference=int(_stat(entry, 'total_goal_differential', 'goal_difference', 'goal_differential')),
+                logo_url=_logo_url(club) if club else None
+            ))
+        tables[name] = sorted(rows, key=lambda row: row.position)
+    return tables
+
+
+class LogoCache:
+    """Club logos on disk by opta ID, downloaded once"""
+    def __init__(self, directory: str = LOGO_DIR):
+        self.directory = directory
+        self._images: Dict[int, Optional[Image.Image]] = {}
+
+    def _path(self, opta_id: int) -> str:
+        return f'{self.directory}/{opta_id}.png'
+
+    async def fetch(self, client: MLSApiClient, opta_id: int, url: Optional[str]) -> None:
+        """Download a logo unless it is already cached"""
+        if not url or os.path.exists(self._path(opta_id)):
+            return
+        try:
+            data = await client.download_club_logo(url)
+            with Image.open(io.BytesIO(data)) as im:
+                im = im.convert('RGBA')
+                os.makedirs(self.directory, exist_ok=True)
+                im.save(self._path(opta_id))
+        except (MLSApiError, OSError) as e:
+            logger.warning(f'Could not cache logo for {opta_id}: {e}')
+
+    def get(self, opta_id: Optional[int], size: int) -> Optional[Image.Image]:
+        if opta_id is None:
+            return None
+        if opta_id not in self._images:
+            path = self._path(opta_id)
+            self._images[opta_id] = Image.open(path).convert('RGBA') if os.path.exists(path) else None
+        logo = self._images[opta_id]
+        if logo is None:
+            return None
+        logo = logo.copy()
+        logo.thumbnail((size, size), Image.Resampling.LANCZOS)
+        return logo
+
+
+class _Canvas:
+    """Top-to-bottom drawing helpers shared by both widgets"""
+    def __init__(self, layout: Layout, height: int):
+        self.layout = layout
+        self.image = Image.new('RGB', (layout.width, height), layout.background)
+        self.draw = ImageDraw.Draw(self.image)
+        self.font = layout.font()
+        self.bold = layout.font(layout.title_size)
+        self.y = 0
+
+    def title(self, text: str) -> None:
+        lt = self.layout
+        self.draw.rectangle((0, self.y, lt.width, self.y + lt.title_height), fill=lt.title_background)
+        self.text(lt.margin, self.y, lt.title_height, text, self.bold, lt.title_text)
+        self.y += lt.title_height
+
+    def text(self, x: int, top: int, height: int, text: str, font=None, fill=None, anchor: str = 'lm') -> None:
+        self.draw.text((x, top + height // 2), text, font=font or self.font, fill=fill or self.layout.text, anchor=anchor)
+
+    def logo(self, logo: Optional[Image.Image], x: int, top: int, height: int, label: str = '') -> None:
+        size = self.layout.logo_size
+        if logo is None:
+            # no logo cached: a plain badge with the club's abbreviation
+            box = (x, top + (height - size) // 2, x + size, top + (height + size) // 2)
+            self.draw.ellipse(box, outline=self.layout.rule)
+            self.text(x + size // 2, top, height, label[:3].upper(), self.layout.font(max(8, size // 3)), self.layout.muted, 'mm')
+            return
+        offset = (x + (size - logo.width) // 2, top + (height - logo.height) // 2)
+        self.image.paste(logo, offset, logo)
+
+    def rule(self) -> None:
+        self.draw.line((0, self.y, self.layout.width, self.y), fill=self.layout.rule)
+
+
+def render_standings(name: str, rows: List[StandingsRow], logos: LogoCache,
+                     layout: Optional[Layout] = None, highlight: Iterable[int] = TEAMS) -> Image.Image:
+    lt = layout or Layout.for_widget(name)
+    resolver = clubs.get_resolver()
+    highlight = set(highlight)
+    canvas = _Canvas(lt, lt.title_height + lt.header_height + lt.row_height * len(rows))
+    canvas.title(name)
+
+    # right-aligned stat columns: label, width
+    columns = [('Pts', 38), ('GP', 32), ('W', 28), ('L', 28), ('T', 28), ('GD', 36)]
+    right = lt.width - lt.margin
+    xs = []
+    for label, width in reversed(columns):
+        xs.append(right)
+        right -= width
+    xs.reverse()
+    name_x = lt.margin + 24 + lt.logo_size + 8
+
+    canvas.text(lt.margin, canvas.y, lt.header_height, '#', fill=lt.muted)
+    canvas.text(name_x, canvas.y, lt.header_height, 'Club', fill=lt.muted)
+    for (label, _), x in zip(columns, xs):
+        canvas.text(x, canvas.y, lt.header_height, label, fill=lt.muted, anchor='rm')
+    canvas.y += lt.header_height
+    canvas.rule()
+
+    for i, row in enumerate(rows):
+        fill = lt.highlight if row.opta_id in highlight else lt.stripe if i % 2 else lt.background
+        canvas.draw.rectangle((0, canvas.y + 1, lt.width, canvas.y + lt.row_height), fill=fill)
+        canvas.text(lt.margin, canvas.y, lt.row_height, str(row.position))
+        club = resolver.by_opta(row.opta_id) if row.opta_id else None
+        label = club.abbrev if club else row.name
+        canvas.logo(logos.get(row.opta_id, lt.logo_size), lt.margin + 24, canvas.y, lt.row_height, label)
+        canvas.text(name_x, canvas.y, lt.row_height, row.name)
+        values = [row.points, row.played, row.wins, row.losses, row.draws, f'{row.goal_difference:+d}']
+        for value, x in zip(values, xs):
+            canvas.text(x, canvas.y, lt.row_height, str(value), anchor='rm')
+        canvas.y += lt.row_height
+    return canvas.image
+
+
+def render_schedule(title: str, matches: List[MatchSchedule], team_id: str, logos: LogoCache,
+                    layout: Optional[Layout] = None) -> Image.Image:
+    lt = layout or Layout.for_widget(title)
+    resolver = clubs.get_resolver()
+    canvas = _Canvas(lt, lt.title_height + lt.row_height * 2 * len(matches))
+    canvas.title(title)
+
+    for match in matches:
+        home = match.home_team_id == team_id
+        opponent_id = match.away_team_id if home else match.home_team_id
+        opponent_name = (match.away_team_name if home else match.home_team_name) or ''
+        # most clubs have no sportec ID in util.names, so fall back to the name
+        opponent = resolver.by_sportec(opponent_id) or (resolver.resolve(opponent_name) if opponent_name else None)
+        opponent_code = match.away_team_three_letter_code if home else match.home_team_three_letter_code
+        kickoff = match.planned_kickoff_time.astimezone() if match.planned_kickoff_time else None
+
+        top = canvas.y
+        height = lt.row_height * 2
+        when = kickoff.strftime('%a %b %d') if kickoff else 'TBD'
+        canvas.text(lt.margin, top, lt.row_height, when, fill=lt.muted)
+        canvas.text(lt.margin, top + lt.row_height, lt.row_height, match.competition_name, fill=lt.muted)
+
+        x = lt.width // 2 - 20
+        canvas.text(x, top, height, 'vs' if home else '@', fill=lt.muted)
+        x += 28
+        label = (opponent.abbrev if opponent else None) or opponent_code or opponent_name
+        canvas.logo(logos.get(opponent.opta_id if opponent else None, lt.logo_size), x, top, height, label)
+        x += lt.logo_size + 8
+        canvas.text(x, top, lt.row_height, (opponent.short_name if opponent else None) or opponent_name)
+
+        if match.match_status == 'finalWhistle' and match.home_team_goals is not None:
+            ours, theirs = (match.home_team_goals, match.away_team_goals) if home else (match.away_team_goals, match.home_team_goals)
+            result = 'W' if ours > theirs else 'L' if ours < theirs else 'D'
+            detail = f'{result} {ours}-{theirs}'
+        else:
+            detail = kickoff.strftime('%I:%M %p').lstrip('0') if kickoff else ''
+        canvas.text(x, top + lt.row_height, lt.row_height, detail, fill=lt.muted)
+
+        canvas.y += height
+        canvas.rule()
+    return canvas.image
+
+
+async def get_weeks(client: MLSApiClient, team_id: str, now: Optional[datetime] = None) -> List[List[MatchSchedule]]:
+    """The team's matches for the first two weeks (Monday to Sunday) with any"""
+    now = now or datetime.now().astimezone()
+    monday = (now - timedelta(days=now.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+    index = schedule_index.get_index()
+    weeks = []
+    for week in range(SCHEDULE_WEEKS):
+        start = monday + timedelta(weeks=week)
+        end = start + timedelta(weeks=1)
+        if len(index):
+            matches = index.range(start, end, team_id)
+        else:
+            matches = await client.get_schedule(
+                get_current_season(),
+                match_date_gte=start.date().isoformat(),
+                match_date_lte=(end - timedelta(days=1)).date().isoformat(),
+                team_id=team_id
+            )
+        if matches:
+            weeks.append(matches)
+        if len(weeks) == 2:
+            break
+    return weeks
+
+
+def _save(name: str, image: Image.Image) -> str:
+    return image_pipeline.save(name, image_pipeline.process_image(image, padding=image_pipeline.PADDING))
+
+
+async def render(team: int = TEAMS[0]) -> List[str]:
+    """Render and save the standings and schedule images; returns their names"""
+    logos = LogoCache()
+    team_id = clubs.get_resolver().by_opta(team).sportec_id
+    names = []
+    async with MLSApiClient() as client:
+        data = await client.get_standings(get_current_season())
+        tables = parse_standings(data)
+        rows = [row for table in tables.values() for row in table]
+        await asyncio.gather(*(logos.fetch(client, row.opta_id, row.logo_url) for row in rows if row.opta_id))
+        weeks = await get_weeks(client, team_id)
+
+    for name, table in tables.items():
+        _save(name, render_standings(name, table, logos))
+        names.append(name)
+    for title, matches in zip(['This Week', 'Next Week'], weeks):
+        _save(title, render_schedule(title, matches, team_id, logos))
+        names.append(title)
+    logger.info(f'Rendered widget images: {names}')
+    return names
+
+
+async def refresh(subreddit: str = SUB) -> Dict[str, bool]:
+    """Render the widget images and upload the ones that changed"""
+    await render()
+    return await widgets.update_image_widgets(widgets.IMAGE_WIDGETS, subreddit)
+
+
+async def main():
+    try:
+        names = await render()
+        message = f"Rendered widget images: {', '.join(names)}."
+        logger.info(message)
+        msg.send(message)
+    except Exception as e:
+        message = f'Error rendering widget images.\n{str(e)}'
+        logger.error(message)
+        msg.send(message)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(prog='widget_renderer.py', description='Render standings and schedule widgets')
+    parser.add_argument('-u', '--upload', action='store_true', help='Upload changed images')
+    parser.add_argument('-s', '--sub', help='Subreddit')
+    args = parser.parse_args()
+    asyncio.run(refresh(args.sub or SUB) if args.upload else main())
@@ -1,97 +1,88 @@
 import argparse
 import asyncio
 import asyncpraw.models
-from datetime import datetime
-from PIL import Image
+import logging
+import os
 from typing import Optional
 
 import discord as msg
-from reddit_client import RedditClient
-import util
+import image_pipeline
+from reddit_client import RedditClient, client_session
 from config import SUB
 
+logger = logging.getLogger(__name__)
+
 parser = argparse.ArgumentParser(prog='widgets.py', usage='%(prog)s [options]', description='')
 parser.add_argument('-s', '--sub', help='Subreddit')
 
-"""
-Image Widget names:
-"Western Conference PNG"
-"This Week PNG"
-"Next Week PNG"
-"""
-
-
-async def get_sidebar_widgets(reddit, subreddit) -> asyncpraw.models.SubredditWidgets:
-    """Returns a list of the widgets in a subreddit's sidebar"""
-    if reddit is None:
-        reddit = util.get_reddit()
-    sub = await reddit.subreddit(subreddit)
-    return sub.widgets
-
-
-async def get_image_data(widget, image_path, size):
-    image_url = await widget.mod.upload_image(image_path)
-    image_data = [{'width': size[0], 'height': size[1], 'url': image_url, 'linkUrl': ''}]
-    return image_data
+# image widgets are named "<name> PNG" on the sidebar
+IMAGE_WIDGETS = ['Western Conference', 'This Week', 'Next Week']
 
 
-async def update_widget(widget_name, data, subreddit='stlouiscitysc'):
-    # TODO refactor this with the new client!
-    r = util.get_reddit()
-    widget_obj = await get_sidebar_widgets(r, subreddit)
-    updated = False
-    async for w in widget_obj.sidebar():
-        if w.shortName == widget_name:
+async def update_widget(widget_name, data, subreddit='stlouiscitysc', reddit: Optional[RedditClient] = None):
+    """Update a text widget (``data`` is a string) or an image widget (``(path, size)``)"""
+    if isinstance(data, str):
+        async with client_session(reddit) as client:
+            widgets, index = await client.get_sidebar_index(subreddit)
+            w = index.get(widget_name)
+            if w is None:
+                msg.send(f'No widgets matching name "{widget_name}" on subreddit "{subreddit}" updated.', tag=True)
+                return False
             try:
-                mod: asyncpraw.models.WidgetModeration = w.mod
-                if isinstance(data, str):
-                    await mod.update(text=data)
-                else:
-                    image_data = await get_image_data(widget_obj, data[0], data[1])
-                    await mod.update(data=image_data)
-                updated = True
+                await client.update_widget(w, text=data)
                 msg.send(f'Updated {widget_name} widget!')
-                break
+                return True
             except Exception as e:
                 message = (
                     f'Error while updating {widget_name} widget.\n'
                     f'{str(e)}\n'
                 )
                 msg.send(message, tag=True)
-    await r.close()
+                return False
+    async with client_session(reddit) as client:
+        return await client.update_image_widget(widget_name, data[0], data[1], subreddit)
+
+
+async def update_image_widgets(names, subreddit='stlouiscitysc', reddit: Optional[RedditClient] = None) -> dict[str, bool]:
+    """Upload the changed images among ``names`` with one Reddit session"""
+    images = {}
+    for name in names:
+        widget_name = f'{name} PNG'
+        entry = image_pipeline.get_entry(name)
+        if entry is None or not os.path.exists(entry['file']):
+            msg.send(f'Failed to update widget {widget_name}: no image.')
+            continue
+        if not image_pipeline.needs_upload(entry, subreddit):
+            logger.info(f'{widget_name} unchanged since last upload to {subreddit}, skipping')
+            continue
+        images[name] = entry
+    if not images:
+        return {}
+
+    async with client_session(reddit) as client:
+        results = await client.update_image_widgets(
+            {f'{name} PNG': (entry['file'], (entry['width'], entry['height'])) for name, entry in images.items()},
+            subreddit
+        )
+    updated = {}
+    for name, entry in images.items():
+        updated[name] = results.get(f'{name} PNG', False)
+        if updated[name]:
+            image_pipeline.mark_uploaded(name, subreddit, entry['dhash'])
     return updated
 
 
-async def update_image_widget(name, subreddit='stlouiscitysc'):
-    now = datetime.now()
-    widget_name = f'{name} PNG'
-    image_path = f'png/{name}-{now.month}-{now.day}.png'
-    try:
-        im = Image.open(image_path)
-    except:
-        msg.send(f'Failed to update widget {image_path}.')
-        return False
-    size = im.size # format (width, height) tuple
-    async with RedditClient() as client:
-        return await client.update_image_widget(widget_name, image_path, size, subreddit)
+async def update_image_widget(name, subreddit='stlouiscitysc', reddit: Optional[RedditClient] = None):
+    results = await update_image_widgets([name], subreddit, reddit)
+    return results.get(name, False)
 
 
 async def main():
     args = parser.parse_args()
     sub: Optional[str] = args.sub
     if sub:
-        print(f'updating widget for sub {sub}')
-        await update_image_widget('Western Conference', sub)
-    else:
-        await update_image_widget('Western Conference', SUB)
-    if sub:
-        await update_image_widget('This Week', sub)
-    else:
-        await update_image_widget('This Week', SUB)
-    if sub:
-        await update_image_widget('Next Week', sub)
-    else:
-        await update_image_widget('Next Week', SUB)
+        logger.info(f'updating widgets for sub {sub}')
+    await update_image_widgets(IMAGE_WIDGETS, sub or SUB)
 
 
 if __name__ == '__main__':
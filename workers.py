@@ -0,0 +1,153 @@
+"""
+Isolated worker processes for heavy scheduled jobs.
+
+Scrapers, Playwright and widget uploads run in a fresh Python process per
+job, so their blocking I/O, parsing and Chromium never touch the
+controller's event loop. Each job gets a hard timeout and an optional
+address-space limit, and hands its (picklable) return value back over a
+dedicated pipe. A job that crashes, runs out of memory or hangs is killed
+and reported as a ``WorkerError``; the controller keeps running.
+
+Run as ``python -m workers <module:function> <result fd> <memory MB>`` with
+the pickled ``(args, kwargs, argv)`` on stdin.
+"""
+import asyncio
+import importlib
+import inspect
+import logging
+import os
+import pickle
+import sys
+import traceback
+from typing import Any, Optional
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+logger = logging.getLogger(__name__)
+
+# seconds to wait after SIGTERM before SIGKILL
+KILL_GRACE = 5
+
+ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class WorkerError(Exception):
+    """A worker job failed, timed out or died"""
+    pass
+
+
+def _resolve(target: str):
+    """Import ``'module:function'``."""
+    module_name, _, func_name = target.partition(':')
+    return getattr(importlib.import_module(module_name), func_name)
+
+
+class WorkerPool:
+    def __init__(self, max_workers: int = 2):
+        self._slots = asyncio.Semaphore(max_workers)
+
+    async def run(
+        self,
+        target: str,
+        *args,
+        timeout: float = 900,
+        memory_mb: Optional[int] = None,
+        **kwargs
+    ) -> Any:
+        """Run ``target`` (``'module:function'``, sync or async) in a new process.
+
+        Waits for a free slot first. Returns the job's return value, or
+        raises ``WorkerError`` on failure, timeout or a crash.
+        """
+        async with self._slots:
+            return await self._run(target, args, kwargs, timeout, memory_mb)
+
+    async def _run(self, target: str, args: tuple, kwargs: dict, timeout: float, memory_mb: Optional[int]) -> Any:
+        loop = asyncio.get_running_loop()
+        read_fd, write_fd = os.pipe()
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.pathsep.join(filter(None, [ROOT_DIR, env.get('PYTHONPATH')]))
+        try:
+            process = await asyncio.create_subprocess_exec(
+                sys.executable, '-m', 'workers', target, str(write_fd), str(memory_mb or 0),
+                stdin=asyncio.subprocess.PIPE,
+                pass_fds=(write_fd,),
+                env=env
+            )
+        finally:
+            os.close(write_fd)
+        logger.info(f'Started worker {target} (pid {process.pid})')
+
+        reader = asyncio.StreamReader()
+        transport, _ = await loop.connect_read_pipe(
+            lambda: asyncio.StreamReaderProtocol(reader), os.fdopen(read_fd, 'rb')
+        )
+        try:
+            # jobs that parse their own command line see the controller's options
+            process.stdin.write(pickle.dumps((args, kwargs, sys.argv[1:])))
+            process.stdin.close()
+            result, _ = await asyncio.wait_for(asyncio.gather(reader.read(), process.wait()), timeout)
+        except asyncio.TimeoutError:
+            await self._kill(process)
+            raise WorkerError(f'{target} timed out after {timeout}s')
+        except asyncio.CancelledError:
+            await self._kill(process)
+            raise
+        finally:
+            transport.close()
+
+        if not result:
+            raise WorkerError(f'{target} died with exit code {process.returncode}')
+        status, payload = pickle.loads(result)
+        if status == 'error':
+            raise WorkerError(f'{target} failed: {payload}')
+        logger.info(f'Worker {target} finished')
+        return payload
+
+    async def _kill(self, process: asyncio.subprocess.Process) -> None:
+        if process.returncode is not None:
+            return
+        process.terminate()
+        try:
+            await asyncio.wait_for(process.wait(), KILL_GRACE)
+        except asyncio.TimeoutError:
+            logger.warning(f'Worker pid {process.pid} ignored SIGTERM, killing')
+            process.kill()
+            await process.wait()
+
+
+def _main(target: str, result_fd: int, memory_mb: int) -> None:
+    import log_config
+
+    root = logging.getLogger()
+    root.setLevel(logging.INFO)
+    root.addHandler(log_config.get_file_handler('worker.log'))
+
+    if memory_mb and resource is not None:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+    try:
+        args, kwargs, argv = pickle.loads(sys.stdin.buffer.read())
+        sys.argv = [target] + argv
+        func = _resolve(target)
+        result = func(*args, **kwargs)
+        if inspect.iscoroutine(result):
+            result = asyncio.run(result)
+        payload = ('ok', result)
+    except BaseException as e:
+        logger.exception(f'Worker job {target} failed')
+        payload = ('error', f'{type(e).__name__}: {e}\n{traceback.format_exc()}')
+    try:
+        data = pickle.dumps(payload)
+    except Exception as e:
+        data = pickle.dumps(('error', f'unpicklable result: {e}'))
+    with os.fdopen(result_fd, 'wb') as f:
+        f.write(data)
+
+
+if __name__ == '__main__':
+    _main(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]))